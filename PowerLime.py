@@ -2,6 +2,7 @@ from powerlime.format.c import *
 from powerlime.format.python import *
 # from powerlime.help.haskell import *
 from powerlime.help.python import *
+from powerlime.fileindex import *
 from powerlime.cursor import *
 from powerlime.layout import *
 from powerlime.misc import *
@@ -12,11 +13,11 @@ if True:
     import os.path
     import sys
 
-    from glob import glob
-
     from sublime import packages_path as get_packages_path
     from sublime_plugin import reload_plugin, EventListener
 
+    from powerlime.statcache import stat_cache
+
     def split_path(path):
         ''' Split path into list of components. '''
         components = []
@@ -34,6 +35,8 @@ if True:
 
     class ComplexPluginReloader(EventListener):
         def on_post_save(self, view):
+            stat_cache.forget(view.file_name())
+
             # Assume both paths are already absolute, only normalize the case.
             packages_path = split_path(os.path.normcase(get_packages_path()))
             file_name = split_path(os.path.normcase(view.file_name()))
@@ -65,6 +68,7 @@ if True:
 
             # The module is indirectly loaded from some package top-level
             # module, so reload them too, to see the changes in Sublime.
-            package_path.append('*.py')
-            for file_name in glob(os.path.join(*package_path)):
-                reload_plugin(file_name)
+            package_dir = os.path.join(*package_path)
+            for name in sorted(stat_cache.listdir(package_dir) or ()):
+                if name.endswith('.py') and not name.startswith('.'):
+                    reload_plugin(os.path.join(package_dir, name))
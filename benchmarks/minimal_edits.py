@@ -0,0 +1,97 @@
+''' Compares replacing whole import and include blocks with applying only the
+changed line hunks, on large generated files. Reports the number of edit
+operations, characters rewritten and time spent.
+
+Usage: python benchmarks/minimal_edits.py [blocks...]
+'''
+import os.path
+import random
+import sys
+
+from timeit import default_timer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from powerlime.format.diff import line_hunks
+from powerlime.format.pyimports import PythonImportFormatter, scan_imports
+
+BLOCK_LINES = 30
+REPEAT = 3
+
+
+def generate_python(blocks):
+    ''' Returns source with sorted import blocks, where one line is moved in
+    every block. '''
+    parts = []
+    for block in xrange(blocks):
+        lines = ['import module_{0}_{1:02}\n'.format(block, i)
+                 for i in xrange(BLOCK_LINES)]
+        lines.insert(random.randrange(BLOCK_LINES),
+                     lines.pop(random.randrange(BLOCK_LINES)))
+        parts.extend(lines)
+        parts.append('\n\ndef function_{0}():\n    pass\n\n\n'.format(block))
+    return u''.join(parts)
+
+
+def generate_cxx(blocks):
+    parts = []
+    for block in xrange(blocks):
+        lines = ['#include "dir/header_{0}_{1:02}.h"'.format(block, i)
+                 for i in xrange(BLOCK_LINES)]
+        lines.insert(random.randrange(BLOCK_LINES),
+                     lines.pop(random.randrange(BLOCK_LINES)))
+        parts.append((u'\n'.join(lines), u'\n'.join(sorted(lines))))
+    return parts
+
+
+def python_edits(text):
+    formatter = PythonImportFormatter({})
+    edits = []
+    for block in reversed(scan_imports(text)):
+        new_text = formatter.format(block.stmts)
+        old_text = text[block.start:block.end]
+        if new_text != old_text:
+            edits.append((block.start, old_text, new_text))
+    return edits
+
+
+def measure(edits, minimal):
+    ''' Returns time, operations and rewritten characters. '''
+    best = float('inf')
+    for _ in xrange(REPEAT):
+        operations = 0
+        size = 0
+        start = default_timer()
+        for offset, old_text, new_text in edits:
+            if minimal:
+                for a, b, text in line_hunks(old_text, new_text):
+                    operations += 1
+                    size += len(text) + b - a
+            else:
+                operations += 1
+                size += len(new_text) + len(old_text)
+        best = min(best, default_timer() - start)
+    return best, operations, size
+
+
+def report(name, edits):
+    for minimal in (False, True):
+        elapsed, operations, size = measure(edits, minimal)
+        print '{0:>8} {1:>10} {2:>10} {3:>12} {4:>10.2f}'.format(
+            name, 'hunks' if minimal else 'whole', operations, size,
+            elapsed * 1000)
+
+
+def main():
+    random.seed(0)
+    sizes = [int(arg) for arg in sys.argv[1:]] or [100, 1000]
+    print '{0:>8} {1:>10} {2:>10} {3:>12} {4:>10}'.format(
+        'blocks', 'mode', 'edits', 'chars', 'diff ms')
+    for blocks in sizes:
+        report('py {0}'.format(blocks), python_edits(generate_python(blocks)))
+        report('c {0}'.format(blocks),
+               [(0, old, new) for old, new in generate_cxx(blocks)])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+''' Compares the import scanner with the former regex search followed by
+ast.parse of every block, on large generated modules. Block counts differ as
+the regex also matches import lines inside docstrings.
+
+Generated modules include backslash-continued imports aligned with padding
+after the import keyword and ending with a comment, next to big string
+literals. The regex retries the whole continuation for every split of the
+padding there, so its time grows with both.
+
+Usage: python benchmarks/pyimports_scan.py [lines...]
+'''
+import ast
+import os.path
+import re
+import sys
+
+from timeit import default_timer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from powerlime.format.pyimports import scan_imports
+
+
+IMPORT_START_RE = r'(?:from[ \t]+[\w.]+[ \t]+)?import[\ \t]+'
+IMPORT_PAREN_RE = r'\([^(#)]*\)[\ \t]*'
+IMPORT_ESC_RE = r'[^\\#\n]*(?:\\\n[^\\#\n]*)*'
+IMPORT_RE = re.compile(r'^({0}(?:{1}|{2})\n)+'.format(
+    IMPORT_START_RE, IMPORT_PAREN_RE, IMPORT_ESC_RE), re.M)
+
+REPEAT = 30
+
+# Padding after the import keyword and number of continuation lines of the
+# aligned imports.
+ALIGN_PADDING = 80
+CONTINUED_NAMES = 60
+
+
+def generate_module(lines):
+    parts = [
+        '"""Generated module.\n\n',
+        'import this_is_not_an_import\n' * 20,
+        '"""\n',
+        'import os\nimport sys\nfrom collections import (OrderedDict,\n'
+        '    defaultdict)\nfrom a.b import c, \\\n    d\n\n'
+    ]
+    count = 0
+    while count < lines:
+        parts.append('\n\ndef function_{0}(x):\n'
+                     '    """{1}\n    """\n'
+                     '    import local_module\n'
+                     '    return x + {0}\n'.format(count, 'docs ' * 40 + '\n' *
+                                                   30))
+        if count % 50 == 0:
+            parts.append('\nfrom module_{0} import name_{0}\n'
+                         'import module_{0}_b\n'.format(count))
+        if count % 1000 == 0:
+            names = ', \\\n    '.join('name_{0}'.format(i)
+                                       for i in xrange(CONTINUED_NAMES))
+            parts.append('\nfrom aligned_{0} import{1}{2}  # noqa\n'
+                         'TEXT_{0} = """{3}"""\n'.format(
+                             count, ' ' * ALIGN_PADDING, names,
+                             'text \\\\ ' * 2000))
+        count += 40
+    return ''.join(parts)
+
+
+def scan_regex(text):
+    blocks = []
+    for match in IMPORT_RE.finditer(text):
+        try:
+            tree = ast.parse(match.group())
+        except (SyntaxError, TypeError):
+            continue
+        blocks.append((match.start(), match.end(), tree.body))
+    return blocks
+
+
+def measure(func, text):
+    best = float('inf')
+    for _ in xrange(REPEAT):
+        start = default_timer()
+        result = func(text)
+        best = min(best, default_timer() - start)
+    return best, len(result)
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [2000, 20000, 100000]
+    print '{0:>8} {1:>14} {2:>14} {3:>8}'.format('lines', 'regex+ast ms',
+                                                  'scan ms', 'blocks')
+    for size in sizes:
+        text = generate_module(size).decode('utf-8')
+        regex_time, regex_blocks = measure(scan_regex, text)
+        scan_time, scan_blocks = measure(scan_imports, text)
+        print '{0:>8} {1:>14.1f} {2:>14.1f} {3:>8}'.format(
+            text.count('\n'), regex_time * 1000, scan_time * 1000,
+            '{0}/{1}'.format(scan_blocks, regex_blocks))
+
+
+if __name__ == '__main__':
+    main()
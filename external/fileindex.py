@@ -0,0 +1,144 @@
+import os
+import os.path
+import sys
+
+from filescan import is_excluded
+
+# Include directives are found the same way the include sorter does.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+from powerlime.format.cincludes import CXX_EXTENSIONS, find_include_names, \
+    resolve_include
+
+# Listed directories: mtime, file names and subdirectory names.
+dirs = {}
+
+# Scanned sources: (mtime, size) and names of included files.
+sources = {}
+
+# Resolved includes per (directory, name), valid for the last set of paths.
+resolved = {}
+last_paths = None
+
+
+def list_dir(path):
+    ''' Returns inode, file names and subdirectory names of path, reusing the
+    previous listing if the directory didn't change. '''
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None, (), ()
+    inode = (stat.st_dev, stat.st_ino)
+    cached = dirs.get(path)
+    if cached is not None and cached[0] == stat.st_mtime:
+        return inode, cached[1], cached[2]
+
+    files = []
+    subdirs = []
+    try:
+        names = os.listdir(path)
+    except OSError:
+        names = []
+    for name in names:
+        if os.path.isdir(os.path.join(path, name)):
+            subdirs.append(name)
+        else:
+            files.append(name)
+    dirs[path] = (stat.st_mtime, files, subdirs)
+    return inode, files, subdirs
+
+
+def collect(path, folder_excludes, file_excludes, paths, seen):
+    inode, files, subdirs = list_dir(path)
+    # Symbolic links may lead to directories already walked.
+    if inode is None or inode in seen:
+        return
+    seen.add(inode)
+    for name in files:
+        if not is_excluded(name, file_excludes):
+            paths.add(os.path.join(path, name))
+    for name in subdirs:
+        if not is_excluded(name, folder_excludes):
+            collect(os.path.join(path, name), folder_excludes, file_excludes,
+                    paths, seen)
+
+
+def get_include_names(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return ()
+    stamp = (stat.st_mtime, stat.st_size)
+    scanned = sources.get(path)
+    if scanned is not None and scanned[0] == stamp:
+        return scanned[1]
+
+    try:
+        with open(path, 'rb') as f:
+            text = f.read().decode('utf-8', 'replace')
+    except IOError:
+        names = ()
+    else:
+        names = find_include_names(text)
+    sources[path] = (stamp, names)
+    return names
+
+
+def index(roots, search_dirs, folder_excludes=(), file_excludes=()):
+    ''' Lists files under roots and resolves includes of C/C++ sources among
+    them, looking in the including file's directory and then search_dirs.
+
+    Returns directory paths, (directory id, base name) pairs of all
+    files in path order, and a table of the ids (positions in that list) of
+    files included by each source id. Only directories and sources changed
+    since the previous call are read again.
+    '''
+    global last_paths
+
+    paths = set()
+    seen = set()
+    for root in roots:
+        collect(os.path.normpath(root), folder_excludes, file_excludes, paths,
+                seen)
+    paths = sorted(paths)
+
+    if paths != last_paths:
+        resolved.clear()
+        last_paths = paths
+    ids = dict((path, path_id) for path_id, path in enumerate(paths))
+    by_name = {}
+    dir_ids = {}
+    dir_names = []
+    files = []
+    for path_id, path in enumerate(paths):
+        dir_name, name = os.path.split(path)
+        by_name.setdefault(name, []).append(path_id)
+        dir_id = dir_ids.get(dir_name)
+        if dir_id is None:
+            dir_id = dir_ids[dir_name] = len(dir_names)
+            dir_names.append(dir_name)
+        files.append((dir_id, name))
+
+    includes = {}
+    for path_id, path in enumerate(paths):
+        if not path.endswith(CXX_EXTENSIONS):
+            continue
+        dir_name = os.path.dirname(path)
+        included = []
+        for name in get_include_names(path):
+            key = (dir_name, name)
+            try:
+                target = resolved[key]
+            except KeyError:
+                target = resolved[key] = resolve_include(
+                    name, [dir_name] + list(search_dirs), ids, by_name, paths)
+            if target is not None and target != path_id:
+                included.append(target)
+        if included:
+            includes[path_id] = included
+
+    # Drop sources that are gone, so they are read again if they come back.
+    for path in list(sources):
+        if path not in ids:
+            del sources[path]
+    return dir_names, files, includes
@@ -0,0 +1,40 @@
+import os
+import os.path
+
+from fnmatch import fnmatch
+from multiprocessing import Pool
+
+# Number of files sent to a worker process at once.
+CHUNK_SIZE = 16
+
+pool = None
+
+
+def get_pool():
+    ''' Returns the process pool shared by all the scans of this worker. '''
+    global pool
+    if pool is None:
+        pool = Pool()
+    return pool
+
+
+def is_excluded(name, excludes):
+    for pattern in excludes:
+        if fnmatch(name, pattern):
+            return True
+    return False
+
+
+def list_files(folders, folder_excludes, file_excludes, suffixes=None):
+    ''' Returns paths of files under folders, leaving out the excluded ones
+    and, if suffixes is given, ones not ending with any of them. '''
+    paths = []
+    for folder in folders:
+        for dir_path, dir_names, file_names in os.walk(folder):
+            dir_names[:] = [name for name in dir_names
+                            if not is_excluded(name, folder_excludes)]
+            for name in file_names:
+                if (suffixes is None or name.endswith(suffixes)) and \
+                        not is_excluded(name, file_excludes):
+                    paths.append(os.path.join(dir_path, name))
+    return paths
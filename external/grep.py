@@ -0,0 +1,96 @@
+import mmap
+import os
+import os.path
+import re
+
+from time import time
+
+from filescan import CHUNK_SIZE, get_pool, list_files
+
+# How long (in seconds) a cached file list stays valid.
+FILE_LIST_TTL = 60
+
+# Files with a NUL byte in the first BINARY_PROBE bytes are skipped.
+BINARY_PROBE = 1024
+
+file_lists = {}
+
+patterns = {}
+
+
+def get_file_list(folders, folder_excludes, file_excludes):
+    ''' Returns list_files results, cached for FILE_LIST_TTL seconds. '''
+    key = (tuple(folders), tuple(folder_excludes), tuple(file_excludes))
+    cached = file_lists.get(key)
+    if cached is not None and time() - cached[0] < FILE_LIST_TTL:
+        return cached[1]
+
+    files = list_files(folders, folder_excludes, file_excludes)
+    file_lists[key] = (time(), files)
+    return files
+
+
+def get_pattern(pattern):
+    regex = patterns.get(pattern)
+    if regex is None:
+        regex = patterns[pattern] = re.compile(pattern)
+    return regex
+
+
+def search_file((pattern, path)):
+    try:
+        f = open(path, 'rb')
+    except IOError:
+        return path, []
+    try:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            return path, []
+        data = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+    except (EnvironmentError, ValueError):
+        return path, []
+    finally:
+        f.close()
+
+    hits = []
+    try:
+        if '\0' in data[:BINARY_PROBE]:
+            return path, hits
+
+        # Rows are counted incrementally between consecutive matches.
+        row = 0
+        row_pos = 0
+        for match in get_pattern(pattern).finditer(data):
+            pos = match.start()
+            row += data[row_pos:pos].count('\n')
+            row_pos = pos
+            line_start = data.rfind('\n', 0, pos) + 1
+            line_end = data.find('\n', pos)
+            if line_end == -1:
+                line_end = size
+            col = len(data[line_start:pos].decode('utf-8', 'replace'))
+            context = data[line_start:line_end].decode('utf-8', 'replace')
+            hits.append((match.group().decode('utf-8'), row, col, pos,
+                         context.strip()))
+    finally:
+        data.close()
+    return path, hits
+
+
+def search(folders, names, folder_excludes=(), file_excludes=()):
+    ''' Yields (name, path, row, col, pos, context) tuples for whole-word
+    occurrences of any of names, in files as soon as they are scanned. '''
+    if not names:
+        return
+    pattern = r'\b(?:{0})\b'.format('|'.join(
+        re.escape(name.encode('utf-8')) for name in names))
+    files = get_file_list(folders, folder_excludes, file_excludes)
+    tasks = ((pattern, path) for path in files)
+    for path, hits in get_pool().imap_unordered(search_file, tasks,
+                                                CHUNK_SIZE):
+        for name, row, col, pos, context in hits:
+            yield name, path, row, col, pos, context
+
+
+def clear_cache():
+    file_lists.clear()
@@ -1,34 +1,351 @@
 import cPickle as pickle
+import httplib
+import os
+import os.path
+import socket
 
-from sys import argv, stdout
-from urllib2 import urlopen
-from urlparse import urlsplit
+from collections import OrderedDict
+from hashlib import md5
+from multiprocessing.pool import ThreadPool
+from thread import get_ident
+from threading import Lock
+from time import time
+from urlparse import urljoin, urlsplit, urlunsplit
 
-from lxml.html import parse
+from lxml.etree import HTMLParser, HTMLPullParser, XPath
 
+PICKLE_PROTOCOL = 2
 
-def class_test(name):
-    return 'contains(concat(" ", normalize-space(@class), " "), " {0} ")'.format(name)
+# How long (in seconds) cached pages are used without revalidation.
+CACHE_TTL = 3600
 
+MAX_REDIRECTS = 5
+TIMEOUT = 30
 
-def query_index(url):
-    ANS_XPATH = '//div[{0}]'.format(class_test('ans'))
-    DOC_XPATH = './following-sibling::div[{0}][1]//text()'.format(class_test('doc'))
-    LOC_XPATH = './following-sibling::div[{0}][1]//text()'.format(class_test('from'))
-    URL_XPATH = './/a[1]/@href'
+# Size of chunks read from responses and fed to the parser.
+READ_SIZE = 16 << 10
 
-    tree = parse(urlopen(url))
-    output = []
-    for ans in tree.xpath(ANS_XPATH):
-        output.append({
-            'name': u''.join(ans.xpath('.//text()')),
-            'loc': u''.join(ans.xpath(LOC_XPATH)),
-            'doc': u''.join(ans.xpath(DOC_XPATH)),
-            'url': unicode(ans.xpath(URL_XPATH)[0])
-        })
-    return output
+cache_dir = None
+cache_ttl = CACHE_TTL
+
+# Idle keep-alive connections, per (scheme, host).
+connections = {}
+connections_lock = Lock()
+
+# Results parsed from fetched pages, per URL, along with the version of the
+# page they come from, most recently used last.
+MAX_PARSED = 32
+parsed = OrderedDict()
+
+# Parsed documentation pages, most recently used last.
+MAX_TREES = 16
+trees = OrderedDict()
+trees_lock = Lock()
+
+# Number of threads fetching documentation pages in the background.
+PREFETCH_THREADS = 4
+prefetch_pool = None
+
+# Background fetches in progress, per page URL.
+prefetching = {}
+prefetching_lock = Lock()
+
+
+def configure(directory=None, ttl=CACHE_TTL):
+    ''' Sets up the on-disk page cache, None disables it. '''
+    global cache_dir, cache_ttl
+    if directory is not None and not os.path.isdir(directory):
+        os.makedirs(directory)
+    cache_dir = directory
+    cache_ttl = ttl
+
+
+def acquire_connection(scheme, host):
+    with connections_lock:
+        idle = connections.get((scheme, host))
+        if idle:
+            return idle.pop()
+    if scheme == 'https':
+        return httplib.HTTPSConnection(host, timeout=TIMEOUT)
+    else:
+        return httplib.HTTPConnection(host, timeout=TIMEOUT)
+
+
+def release_connection(scheme, host, conn):
+    with connections_lock:
+        connections.setdefault((scheme, host), []).append(conn)
+
+
+def open_url(url, headers):
+    ''' Sends a GET request over a pooled connection, returns the connection,
+    the response and its lowercased headers. '''
+    split = urlsplit(url)
+    path = urlunsplit(('', '', split.path or '/', split.query, ''))
+    for attempt in xrange(2):
+        conn = acquire_connection(split.scheme, split.netloc)
+        try:
+            conn.request('GET', path, headers=headers)
+            response = conn.getresponse()
+        except (httplib.HTTPException, socket.error):
+            # The server might have closed an idle connection, retry once
+            # with a fresh one.
+            conn.close()
+            if attempt:
+                raise
+            continue
+        return (conn, response,
+                dict((key.lower(), value)
+                     for key, value in response.getheaders()))
+
+
+def close_url(url, conn, response):
+    ''' Returns the connection to the pool once the response is read. '''
+    if response.will_close:
+        conn.close()
+    else:
+        split = urlsplit(url)
+        release_connection(split.scheme, split.netloc, conn)
+
+
+def read_body(url, entry, target, conn, response):
+    ''' Yields the response body in chunks, stores it in the cache once
+    complete. '''
+    chunks = []
+    finished = False
+    try:
+        while True:
+            chunk = response.read(READ_SIZE)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            yield chunk
+        finished = True
+    finally:
+        if finished:
+            close_url(target, conn, response)
+        else:
+            conn.close()
+    entry['body'] = ''.join(chunks)
+    write_cache(url, entry)
+
+
+def get_cache_path(url):
+    return os.path.join(cache_dir, md5(url).hexdigest())
+
+
+def read_cache(url):
+    if cache_dir is None:
+        return None
+    try:
+        with open(get_cache_path(url), 'rb') as f:
+            return pickle.load(f)
+    except (IOError, EOFError, pickle.UnpicklingError):
+        return None
+
+
+def write_cache(url, entry):
+    if cache_dir is None:
+        return
+    path = get_cache_path(url)
+    tmp_path = '{0}.{1}.{2}.tmp'.format(path, os.getpid(), get_ident())
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(entry, f, PICKLE_PROTOCOL)
+    if os.name == 'nt' and os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp_path, path)
+
+
+def get_page_url(url):
+    return urlunsplit(urlsplit(url)[:4] + ('', ))
+
+
+def fetch(url):
+    ''' Returns version of the page at url, which changes only when the page
+    is downloaded again, and an iterator over chunks of its body. '''
+    url = get_page_url(url)
+    entry = read_cache(url)
+    now = time()
+    if entry is not None and now - entry['checked'] < cache_ttl:
+        return entry['version'], iter([entry['body']])
+
+    # Revalidate the cached page, if any.
+    headers = {}
+    if entry is not None:
+        if entry['etag'] is not None:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified'] is not None:
+            headers['If-Modified-Since'] = entry['last_modified']
+
+    target = url
+    for _ in xrange(MAX_REDIRECTS):
+        conn, response, response_headers = open_url(target, headers)
+        if response.status not in (301, 302, 303, 307) or \
+                'location' not in response_headers:
+            break
+        response.read()
+        close_url(target, conn, response)
+        target = urljoin(target, response_headers['location'])
+
+    if response.status == 304 and entry is not None:
+        response.read()
+        close_url(target, conn, response)
+        entry['checked'] = now
+        write_cache(url, entry)
+        return entry['version'], iter([entry['body']])
+    elif response.status == 200:
+        return now, read_body(url, {
+            'version': now,
+            'checked': now,
+            'etag': response_headers.get('etag'),
+            'last_modified': response_headers.get('last-modified')
+        }, target, conn, response)
+    else:
+        conn.close()
+        raise IOError('HTTP error {0}: {1}'.format(response.status, url))
+
+
+TEXT_XPATH = XPath('string()')
+URL_XPATH = XPath('.//a[1]/@href')
+DETAILS_XPATH = XPath('(//*[@name=$name]/../ancestor::div[@class="top"]'
+                      '//div[@class="doc"])[1]//text()')
+
+
+def get_classes(elem):
+    return elem.get('class', '').split()
+
+
+def iter_events(parser, chunks):
+    ''' Feeds chunks to a pull parser, yielding events as they come. '''
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event in parser.read_events():
+            yield event
+
+    # libxml2 holds back the last elements until the input ends.
+    parser.close()
+    for event in parser.read_events():
+        yield event
+
+
+def complete_result(result):
+    ''' Fills in missing location and documentation, the quick panel only
+    takes strings. '''
+    result['loc'] = result['loc'] or u''
+    result['doc'] = result['doc'] or u''
+    return result
+
+
+def parse_index(chunks):
+    ''' Yields results as soon as their answer, location and documentation
+    divs are parsed. '''
+    parser = HTMLPullParser(events=('end', ), tag='div')
+    result = None
+    for event, elem in iter_events(parser, chunks):
+        classes = get_classes(elem)
+        if 'ans' in classes:
+            if result is not None:
+                yield complete_result(result)
+            result = {
+                'name': unicode(TEXT_XPATH(elem)),
+                'loc': None,
+                'doc': None,
+                'url': unicode(URL_XPATH(elem)[0])
+            }
+        elif result is None:
+            continue
+        elif 'from' in classes and result['loc'] is None:
+            result['loc'] = unicode(TEXT_XPATH(elem))
+        elif 'doc' in classes and result['doc'] is None:
+            result['doc'] = unicode(TEXT_XPATH(elem))
+        else:
+            continue
+
+        if result['loc'] is not None and result['doc'] is not None:
+            yield complete_result(result)
+            result = None
+    if result is not None:
+        yield complete_result(result)
+
+
+def query_index(url, prefetch=0):
+    ''' Yields search results from the Hoogle page at url, documentation
+    pages of the first prefetch results are fetched in the background. '''
+    version, chunks = fetch(url)
+    cached = parsed.pop(url, None)
+    if cached is not None and cached[0] == version:
+        parsed[url] = cached
+        prefetch_details([result['url'] for result in cached[1][:prefetch]])
+        for result in cached[1]:
+            yield result
+        return
+
+    results = []
+    for result in parse_index(chunks):
+        if len(results) < prefetch:
+            prefetch_details([result['url']])
+        results.append(result)
+        yield result
+    parsed[url] = (version, results)
+    while len(parsed) > MAX_PARSED:
+        parsed.popitem(last=False)
+
+
+def get_tree(page_url):
+    ''' Returns the parsed documentation page. '''
+    version, chunks = fetch(page_url)
+    with trees_lock:
+        cached = trees.pop(page_url, None)
+        if cached is not None and cached[0] == version:
+            trees[page_url] = cached
+            return cached[1]
+
+    parser = HTMLParser()
+    for chunk in chunks:
+        parser.feed(chunk)
+    tree = parser.close()
+
+    with trees_lock:
+        trees[page_url] = (version, tree)
+        while len(trees) > MAX_TREES:
+            trees.popitem(last=False)
+    return tree
+
+
+def get_prefetch_pool():
+    global prefetch_pool
+    if prefetch_pool is None:
+        prefetch_pool = ThreadPool(PREFETCH_THREADS)
+    return prefetch_pool
+
+
+def prefetch_page(page_url):
+    try:
+        get_tree(page_url)
+    finally:
+        with prefetching_lock:
+            del prefetching[page_url]
+
+
+def prefetch_details(urls):
+    ''' Starts fetching documentation pages of urls in the background, each
+    page once, as many anchors share the same page. '''
+    for url in urls:
+        page_url = get_page_url(url)
+        with prefetching_lock:
+            if page_url not in prefetching:
+                prefetching[page_url] = get_prefetch_pool().apply_async(
+                    prefetch_page, (page_url, ))
 
 
 def query_details(url):
-    tree = parse(urlopen(url))
-    return u''.join(tree.xpath('(//*[@name=$name]/../ancestor::div[@class="top"]//div[@class="doc"])[1]//text()', name=urlsplit(url).fragment))
+    page_url = get_page_url(url)
+    with prefetching_lock:
+        pending = prefetching.get(page_url)
+    if pending is not None:
+        # Errors are reported by the fetch below.
+        try:
+            pending.get()
+        except Exception:
+            pass
+    tree = get_tree(page_url)
+    return u''.join(DETAILS_XPATH(tree, name=urlsplit(url).fragment))
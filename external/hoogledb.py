@@ -0,0 +1,205 @@
+import cPickle as pickle
+import os
+import os.path
+import re
+
+PICKLE_PROTOCOL = 2
+
+# Bump when the layout of the on-disk index changes.
+INDEX_VERSION = 2
+
+HACKAGE_URL = 'http://hackage.haskell.org/package/{0}-{1}/docs/{2}.html'
+
+TYPE_KEYWORDS = ('data', 'newtype', 'type', 'class')
+TYPE_TOKEN_RE = re.compile(r"[A-Za-z_][\w']*|->|\S")
+DECL_RE = re.compile(r'^(\(.+?\)|[^\s(]+)\s+::\s*(.*)$')
+OPERATOR_RE = re.compile(r"[^\w'\s]+$")
+
+databases = {}
+
+
+class HoogleIndex(object):
+    ''' Searchable contents of Hoogle text databases.
+
+    entries: (name, kind, module, package, version, signature, doc) tuples.
+    trie: nested dicts keyed by lowercased name characters, lists of entry ids
+    are held under None key.
+    signatures: normalized signatures of values mapped to entry ids.
+    '''
+
+    def __init__(self):
+        self.entries = []
+        self.trie = {}
+        self.signatures = {}
+
+    def add(self, name, kind, module, package, version, signature, doc):
+        entry_id = len(self.entries)
+        self.entries.append((name, kind, module, package, version, signature,
+                             doc))
+
+        node = self.trie
+        for char in name.lower():
+            node = node.setdefault(char, {})
+        node.setdefault(None, []).append(entry_id)
+
+        # Type declarations are shown whole, but only value signatures are
+        # searchable.
+        if signature and kind == 'value':
+            self.signatures.setdefault(normalize_signature(signature),
+                                       []).append(entry_id)
+
+    def find_name(self, name, limit):
+        node = self.trie
+        for char in name.lower():
+            node = node.get(char)
+            if node is None:
+                return []
+
+        # Breadth-first, so that shorter names come first.
+        found = []
+        level = [node]
+        while level and len(found) < limit:
+            next_level = []
+            for node in level:
+                for key, child in sorted(node.iteritems()):
+                    if key is None:
+                        found.extend(child)
+                    else:
+                        next_level.append(child)
+            level = next_level
+
+        # Exact matches go first.
+        found.sort(key=lambda entry_id: self.entries[entry_id][0] != name)
+        return found[:limit]
+
+    def find_signature(self, signature, limit):
+        return self.signatures.get(normalize_signature(signature), [])[:limit]
+
+
+def normalize_signature(signature):
+    ''' Drops the context and renames type variables in the order of
+    appearance, so that equivalent signatures compare equal. '''
+    context, sep, signature = signature.rpartition('=>')
+    names = {}
+    tokens = []
+    for token in TYPE_TOKEN_RE.findall(signature):
+        if token[0].islower() or token[0] == '_':
+            token = names.setdefault(token, 't{0}'.format(len(names)))
+        tokens.append(token)
+    return ' '.join(tokens)
+
+
+def parse_database(path, index):
+    package = version = module = None
+    doc = []
+    with open(path) as f:
+        for line in f:
+            line = line.decode('utf-8', 'replace').rstrip()
+            if line.startswith('--'):
+                text = line[2:]
+                if text.startswith(' |'):
+                    text = text[2:]
+                doc.append(text.strip())
+                continue
+            if not line:
+                continue
+
+            entry_doc = u'\n'.join(doc).strip()
+            doc = []
+            keyword, _, rest = line.partition(' ')
+            if keyword == '@package':
+                package = rest.strip()
+            elif keyword == '@version':
+                version = rest.strip()
+            elif keyword == 'module':
+                module = rest.strip()
+                index.add(module, 'module', module, package, version, None,
+                          entry_doc)
+            elif keyword == 'instance' or module is None:
+                pass
+            elif keyword in TYPE_KEYWORDS:
+                name = rest.rpartition('=>')[2].split()
+                if name:
+                    index.add(name[0], 'type', module, package, version, line,
+                              entry_doc)
+            else:
+                match = DECL_RE.match(line)
+                if match is not None:
+                    name = match.group(1)
+                    if name.startswith('('):
+                        name = name[1:-1]
+                    index.add(name, 'value', module, package, version,
+                              match.group(2), entry_doc)
+
+
+def get_stamp(paths):
+    stamp = []
+    for path in paths:
+        stat = os.stat(path)
+        stamp.append((path, stat.st_mtime, stat.st_size))
+    return INDEX_VERSION, stamp
+
+
+def load(paths, index_path):
+    ''' Returns index of databases at paths, using the on-disk index at
+    index_path if it's up to date. '''
+    stamp = get_stamp(paths)
+    index = databases.get(index_path)
+    if index is not None and index[0] == stamp:
+        return index[1]
+
+    try:
+        with open(index_path, 'rb') as f:
+            index = pickle.load(f)
+    except (IOError, EOFError, pickle.UnpicklingError, ValueError):
+        index = None
+    if index is None or index[0] != stamp:
+        hoogle_index = HoogleIndex()
+        for path in paths:
+            parse_database(path, hoogle_index)
+        index = (stamp, hoogle_index)
+        with open(index_path, 'wb') as f:
+            pickle.dump(index, f, PICKLE_PROTOCOL)
+
+    databases[index_path] = index
+    return index[1]
+
+
+def get_url(name, kind, module, package, version):
+    url = HACKAGE_URL.format(package, version, module.replace('.', '-'))
+    if kind == 'type':
+        url += '#t:' + name
+    elif kind == 'value':
+        url += '#v:' + name
+    return url
+
+
+def query(paths, index_path, text, limit=100):
+    ''' Searches the databases by name or, if the query looks like a type, by
+    signature. Returns dicts in the same shape as hoogle.query_index. '''
+    index = load(paths, index_path)
+    text = text.strip()
+    if '->' in text or text.startswith('::'):
+        entry_ids = index.find_signature(text.lstrip(':'), limit)
+    else:
+        entry_ids = index.find_name(text, limit)
+
+    output = []
+    for entry_id in entry_ids:
+        name, kind, module, package, version, signature, doc = \
+            index.entries[entry_id]
+        if kind == 'module':
+            title = u'module ' + name
+        elif kind == 'type':
+            title = signature
+        elif OPERATOR_RE.match(name):
+            title = u'({0}) :: {1}'.format(name, signature)
+        else:
+            title = u'{0} :: {1}'.format(name, signature)
+        output.append({
+            'name': title,
+            'loc': u'{0} {1}'.format(package, module),
+            'doc': doc,
+            'url': get_url(name, kind, module, package, version)
+        })
+    return output
@@ -0,0 +1,82 @@
+import os
+import os.path
+import sys
+
+from filescan import CHUNK_SIZE, get_pool, list_files
+
+# Import statements are parsed the same way the import formatter does.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+from powerlime.format.pyimports import scan_imports
+
+# Scanned files: (mtime, size) and (symbol, module) pairs imported there.
+files = {}
+
+# Number of files importing each symbol, per symbol and module.
+counts = {}
+
+
+def scan_file(path):
+    try:
+        with open(path, 'rb') as f:
+            text = f.read().decode('utf-8', 'replace')
+    except IOError:
+        return path, ()
+
+    pairs = set()
+    for block in scan_imports(text):
+        for stmt in block.stmts:
+            if getattr(stmt, 'module', None) is None or stmt.level:
+                continue
+            for alias in stmt.names:
+                # Suggestions import the symbol by its own name.
+                if alias.name != '*':
+                    pairs.add((alias.name, stmt.module))
+    return path, pairs
+
+
+def count(pairs, delta):
+    for symbol, module in pairs:
+        modules = counts.setdefault(symbol, {})
+        modules[module] = modules.get(module, 0) + delta
+        if not modules[module]:
+            del modules[module]
+            if not modules:
+                del counts[symbol]
+
+
+def update(folders, folder_excludes=(), file_excludes=()):
+    ''' Rescans Python files in folders changed since the previous call.
+    Returns a table of the module each symbol is most often imported from. '''
+    paths = set(list_files(folders, folder_excludes, file_excludes, '.py'))
+    for path in list(files):
+        if path not in paths:
+            count(files.pop(path)[1], -1)
+
+    changed = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        stamp = (stat.st_mtime, stat.st_size)
+        scanned = files.get(path)
+        if scanned is None or scanned[0] != stamp:
+            changed.append((path, stamp))
+
+    stamps = dict(changed)
+    if changed:
+        for path, pairs in get_pool().imap_unordered(
+                scan_file, [path for path, stamp in changed], CHUNK_SIZE):
+            scanned = files.get(path)
+            if scanned is not None:
+                count(scanned[1], -1)
+            files[path] = (stamps[path], pairs)
+            count(pairs, 1)
+
+    # Ties go to the shorter module name.
+    table = {}
+    for symbol, modules in counts.iteritems():
+        table[symbol] = max(modules.iteritems(),
+                            key=lambda (module, n): (n, -len(module)))[0]
+    return table
@@ -1,22 +1,43 @@
 import cPickle as pickle
+import os
+import sys
 
 from importlib import import_module
-from sys import argv, stdin, stdout
+from itertools import islice
 
 PICKLE_PROTOCOL = 2
 
 
 def main():
-    if len(argv) != 2:
+    if len(sys.argv) != 2:
         raise ValueError('Need exactly 1 argument (module)')
 
-    module = import_module(argv[1])
+    # Results are sent through a private copy of stdout, anything printed by
+    # the handlers or the modules they import goes to stderr instead of
+    # corrupting the pickle stream.
+    output = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+
+    module = import_module(sys.argv[1])
 
     while True:
-        cmd = pickle.load(stdin)
+        cmd = pickle.load(sys.stdin)
         if isinstance(cmd, tuple):
             handler = getattr(module, cmd[0])
-            pickle.dump(handler(*cmd[1], **cmd[2]), stdout, PICKLE_PROTOCOL)
+            result = handler(*cmd[1], **cmd[2])
+            if len(cmd) > 3:
+                # Stream results in batches, terminated with an empty one.
+                result = iter(result)
+                while True:
+                    batch = list(islice(result, cmd[3]))
+                    pickle.dump(batch, output, PICKLE_PROTOCOL)
+                    output.flush()
+                    if not batch:
+                        break
+            else:
+                pickle.dump(result, output, PICKLE_PROTOCOL)
+                output.flush()
         else:
             return
 
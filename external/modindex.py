@@ -0,0 +1,92 @@
+import imp
+import os
+import os.path
+import re
+import sys
+
+from stat import S_ISDIR
+
+IDENTIFIER_RE = re.compile(r'[a-zA-Z_]\w*$')
+
+SUFFIXES = tuple(suffix for suffix, mode, typ in imp.get_suffixes())
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Contents of scanned directories: mtime, whether it's a package, module
+# names and names of subdirectories which may be packages.
+dirs = {}
+
+
+def scan_dir(path):
+    ''' Returns whether path is a package, modules and possible packages
+    directly in it, reusing the previous listing if the directory didn't
+    change. '''
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return False, (), ()
+    if not S_ISDIR(stat.st_mode):
+        return False, (), ()
+    mtime = stat.st_mtime
+    cached = dirs.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1:]
+
+    package = False
+    modules = set()
+    subdirs = []
+    try:
+        names = os.listdir(path)
+    except OSError:
+        names = []
+    for name in names:
+        for suffix in SUFFIXES:
+            if name.endswith(suffix):
+                module = name[:-len(suffix)]
+                if module == '__init__':
+                    package = True
+                elif IDENTIFIER_RE.match(module):
+                    modules.add(module)
+                break
+        else:
+            if IDENTIFIER_RE.match(name):
+                subdirs.append(name)
+
+    dirs[path] = (mtime, package, modules, subdirs)
+    return package, modules, subdirs
+
+
+def collect(path, prefix, names, parents):
+    ''' Adds modules under path to names. parents holds real paths of the
+    packages path is in, so that symlinks pointing to them are skipped. '''
+    real_path = os.path.realpath(path)
+    if real_path in parents:
+        return
+    parents.add(real_path)
+    modules, subdirs = scan_dir(path)[1:]
+    for module in modules:
+        names.add(prefix + module)
+    for name in subdirs:
+        # Each directory is checked for __init__ with its own listing, which
+        # is refreshed once it changes.
+        subdir = os.path.join(path, name)
+        if scan_dir(subdir)[0]:
+            names.add(prefix + name)
+            collect(subdir, prefix + name + '.', names, parents)
+    parents.remove(real_path)
+
+
+def list_modules(folders):
+    ''' Returns sorted names of modules importable from the interpreter's
+    sys.path and folders. Only directories changed since the previous call are
+    listed again. '''
+    roots = []
+    for path in sys.path + list(folders):
+        path = os.path.abspath(path or os.curdir)
+        if path != SCRIPTS_DIR and path not in roots and os.path.isdir(path):
+            roots.append(path)
+
+    names = set(sys.builtin_module_names)
+    for root in roots:
+        collect(root, '', names, set())
+    return sorted(names)
@@ -1,8 +1,38 @@
-from lxml.html import parse
-
-def main(path):
-    output = []
-    tree = parse(open(path))
-    for link in tree.xpath('//dt/a[starts-with(@href, "library/")]'):
-        output.append((link.get('href'), link.text))
-    return output
+import re
+
+from lxml.etree import iterparse
+
+INDEX_ENTRY_RE = re.compile(r'index-\d+$')
+MOD_PREFIX = 'module-'
+
+
+def parse(path, types):
+    ''' Yields (symbol, type) pairs from Python documentation index at path.
+
+    types is a list of (type, regex) pairs, an entry gets the type of the first
+    regex matching its link text.
+    '''
+    classify = re.compile('|'.join('(?P<{0}>{1})'.format(typ, regex)
+                                   for typ, regex in types))
+
+    for event, elem in iterparse(path, events=('end', ), tag=('dt', 'dd'),
+                                 html=True):
+        if elem.tag == 'dt':
+            for link in elem.iterchildren('a'):
+                href = link.get('href', '')
+                if not href.startswith('library/') or link.text is None:
+                    continue
+                sym = href.partition('#')[2]
+                if not sym or INDEX_ENTRY_RE.match(sym):
+                    continue
+                match = classify.search(link.text)
+                if match is not None:
+                    typ = match.lastgroup
+                    if typ == 'mod' and sym.startswith(MOD_PREFIX):
+                        sym = sym[len(MOD_PREFIX):]
+                    yield sym, typ
+
+        # Drop parsed entries, to keep memory usage flat.
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
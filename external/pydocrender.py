@@ -0,0 +1,96 @@
+import os
+import os.path
+import pydoc
+import shutil
+import struct
+import zlib
+
+from collections import OrderedDict
+
+# Maximum total length of cached documentation texts.
+CACHE_SIZE = 8 << 20
+
+cache = OrderedDict()
+cache_size = 0
+
+
+def render_uncached(sym):
+    try:
+        return pydoc.plain(pydoc.render_doc(sym))
+    except (ImportError, pydoc.ErrorDuringImport):
+        return None
+
+
+def render(sym):
+    ''' Returns plain text documentation for sym, or None if not found. '''
+    global cache_size
+
+    try:
+        doc = cache.pop(sym)
+    except KeyError:
+        doc = render_uncached(sym)
+        cache_size += len(doc or '')
+
+    # Most recently used entries are at the end.
+    cache[sym] = doc
+    while cache_size > CACHE_SIZE and len(cache) > 1:
+        _, old_doc = cache.popitem(last=False)
+        cache_size -= len(old_doc or '')
+    return doc
+
+
+def prefetch(syms):
+    for sym in syms:
+        render(sym)
+
+
+# Doc store layout: header, NUL-separated UTF-8 symbols (sorted), table of
+# count + 1 offsets into the data section and zlib-compressed texts.
+STORE_MAGIC = 'PLPYDOC1'
+STORE_HEADER = struct.Struct('<8sII')
+
+
+# Number of rendered symbols between progress reports of build_store.
+PROGRESS_STEP = 500
+
+
+def build_store(path, syms):
+    ''' Renders documentation of syms into doc store at path. Yields numbers
+    of symbols rendered so far and the total every PROGRESS_STEP symbols,
+    then the number of stored entries. '''
+    names = []
+    offsets = [0]
+    tmp_path = path + '.tmp'
+    syms = sorted(set(syms))
+    with open(tmp_path + '.data', 'wb') as data:
+        for i, sym in enumerate(syms):
+            if i and i % PROGRESS_STEP == 0:
+                yield i, len(syms)
+            # A single broken module must not abort the whole build.
+            try:
+                doc = render_uncached(sym)
+            except Exception:
+                continue
+            if doc is None:
+                continue
+            if isinstance(doc, unicode):
+                doc = doc.encode('utf-8')
+            blob = zlib.compress(doc)
+            data.write(blob)
+            names.append(sym)
+            offsets.append(offsets[-1] + len(blob))
+
+    names = u'\0'.join(names).encode('utf-8')
+    with open(tmp_path, 'wb') as out:
+        out.write(STORE_HEADER.pack(STORE_MAGIC, len(offsets) - 1,
+                                    len(names)))
+        out.write(names)
+        out.write(struct.pack('<{0}I'.format(len(offsets)), *offsets))
+        with open(tmp_path + '.data', 'rb') as data:
+            shutil.copyfileobj(data, out)
+    os.remove(tmp_path + '.data')
+
+    if os.name == 'nt' and os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp_path, path)
+    yield len(offsets) - 1
@@ -1,9 +1,14 @@
 import ast
 import os
 import os.path
+import sys
 
 from sqlite3 import connect as sqlite_connect
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+from powerlime.statcache import stat_cache
+
 
 class SymbolDatabase(object):
     def __init__(self, path, others):
@@ -26,6 +31,13 @@ class SymbolDatabase(object):
                 timestamp REAL NOT NULL    -- Last modification time.
             );
             CREATE UNIQUE INDEX IF NOT EXISTS files_path ON files(path);
+
+            -- Symbols looked up by occurrences().
+            CREATE TEMP TABLE queries (
+                query TEXT NOT NULL,      -- Symbol as requested by the user.
+                symbol TEXT NOT NULL,
+                namespace TEXT NOT NULL   -- GLOB pattern for the scope.
+            );
         ''')
 
         self.db_prefixes = ['']
@@ -119,25 +131,38 @@ class SymbolDatabase(object):
             'file': row[5]
         }
 
-    def occurrences(self, symbol):
-        namespace, sep, symbol = symbol.rpartition('.')
-        if sep:
-            namespace = '*.' + namespace
-        else:
-            namespace = '*'
+    def occurrences(self, symbols):
+        if isinstance(symbols, basestring):
+            symbols = [symbols]
 
+        queries = []
+        for query in symbols:
+            namespace, sep, symbol = query.rpartition('.')
+            if sep:
+                namespace = '*.' + namespace
+            else:
+                namespace = '*'
+            queries.append((query, symbol, namespace))
+
+        # Look up all the symbols with a single statement.
+        self.cur.execute('DELETE FROM queries')
+        self.cur.executemany('''
+            INSERT INTO queries(query, symbol, namespace) VALUES(?, ?, ?)
+        ''', queries)
         self.cur.execute('''
-            SELECT s.symbol, s.scope, f.package, s.row, s.col, f.path
-            FROM all_symbols s, all_files f
+            SELECT s.symbol, s.scope, f.package, s.row, s.col, f.path, q.query
+            FROM queries q, all_symbols s, all_files f
             WHERE
+                s.symbol = q.symbol AND
                 s.file_id = f.id AND
                 s.dbid = f.dbid AND
-                s.symbol = :symbol AND
-                GLOB(:namespace, '.' || f.package || '.' || s.scope)
-            ORDER BY s.symbol, f.path, s.row
-        ''', locals())
-        for row in self.cur:
-            yield self._result_row_to_dict(row)
+                GLOB(q.namespace, '.' || f.package || '.' || s.scope)
+            ORDER BY q.rowid, f.path, s.row
+        ''')
+        for row in self.cur.fetchall():
+            result = self._result_row_to_dict(row)
+            result['query'] = row[6]
+            yield result
 
         # for db_prefix in self.db_prefixes:
         #     self.cur.execute('''
@@ -250,7 +275,9 @@ def get_package(path):
         package = [module]
     while True:
         new_path, module = os.path.split(path)
-        if not os.path.isfile(os.path.join(path, '__init__.py')):
+        # Files of a package are usually indexed together, so the same
+        # __init__.py files are probed many times.
+        if not stat_cache.isfile(os.path.join(path, '__init__.py')):
             break
         package.append(module)
         if new_path == path:
@@ -277,8 +304,8 @@ def remove_other_files(file_paths):
     db.remove_other_files(file_paths)
 
 
-def query_occurrences(symbol):
-    return list(db.occurrences(symbol))
+def query_occurrences(symbols):
+    return list(db.occurrences(symbols))
 
 
 def query_all():
@@ -0,0 +1,203 @@
+import os.path
+
+from array import array
+from difflib import get_close_matches
+from itertools import chain
+
+from sublime import windows
+from sublime_plugin import EventListener
+
+from powerlime.statcache import stat_cache
+from powerlime.util import BackgroundIndex, ExternalPythonCaller
+
+
+def get_search_paths(view):
+    ''' Returns directories of the open_search_paths setting, with None
+    standing for the window folders. '''
+    return list(chain.from_iterable(
+        view.window().folders() if dir_name is None else [dir_name]
+        for dir_name in view.settings().get('open_search_paths', ['.', None])
+    ))
+
+
+class FileTable(object):
+    ''' Files under a set of root directories and includes among the C/C++
+    sources there.
+
+    Paths are kept as an id of the directory and the base name, both shared
+    between all the files having them, so large trees take little memory.
+    '''
+
+    # Minimum similarity of base names matched by find_fuzzy.
+    FUZZY_CUTOFF = 0.8
+
+    def __init__(self, roots, dir_names, files, includes):
+        self.roots = roots
+        self.dir_names = dir_names
+        self.dir_ids = dict((dir_name, dir_id)
+                            for dir_id, dir_name in enumerate(dir_names))
+        self.file_dirs = array('l')
+        self.file_names = []
+        self.by_name = {}
+        for dir_id, name in files:
+            self.add_file(dir_id, name)
+        self.includes = includes
+        self.includers = {}
+        for file_id, included in includes.iteritems():
+            for target in included:
+                self.includers.setdefault(target, []).append(file_id)
+
+    def add_file(self, dir_id, name):
+        ids = self.by_name.get(name)
+        if ids is None:
+            ids = self.by_name[name] = []
+        else:
+            # Reuse the string object already stored for the name.
+            name = self.file_names[ids[0]]
+        ids.append(len(self.file_names))
+        self.file_dirs.append(dir_id)
+        self.file_names.append(name)
+
+    def add(self, path):
+        ''' Adds a file created after the table was built. '''
+        dir_name, name = os.path.split(os.path.normpath(path))
+        if self.get_id(path) is not None or not self.covers(dir_name):
+            return
+        dir_id = self.dir_ids.get(dir_name)
+        if dir_id is None:
+            dir_id = self.dir_ids[dir_name] = len(self.dir_names)
+            self.dir_names.append(dir_name)
+        self.add_file(dir_id, name)
+
+    def get_path(self, file_id):
+        return os.path.join(self.dir_names[self.file_dirs[file_id]],
+                            self.file_names[file_id])
+
+    def get_id(self, path):
+        dir_name, name = os.path.split(os.path.normpath(path))
+        dir_id = self.dir_ids.get(dir_name)
+        if dir_id is None:
+            return None
+        for file_id in self.by_name.get(name, ()):
+            if self.file_dirs[file_id] == dir_id:
+                return file_id
+        return None
+
+    def covers(self, dir_name):
+        ''' Checks if dir_name is under one of the indexed roots. '''
+        if not os.path.isabs(dir_name):
+            return False
+        dir_name = os.path.normpath(dir_name)
+        for root in self.roots:
+            if dir_name == root or dir_name.startswith(root + os.sep):
+                return True
+        return False
+
+    def find(self, name, dirs):
+        ''' Returns path of the file name refers to in the first of dirs
+        holding it, or None. Files missing from the index are checked on disk,
+        as they may have been created since it was built. '''
+        for dir_name in dirs:
+            path = os.path.join(dir_name, name)
+            if self.covers(dir_name) and self.get_id(path) is not None:
+                return os.path.normpath(path)
+            if stat_cache.isfile(path):
+                return path
+        return None
+
+    def find_by_suffix(self, name):
+        ''' Returns any indexed path ending with name, or None. '''
+        suffix = os.sep + os.path.normpath(name)
+        for file_id in self.by_name.get(os.path.basename(name), ()):
+            path = self.get_path(file_id)
+            if path.endswith(suffix):
+                return path
+        return None
+
+    def find_fuzzy(self, name, limit):
+        ''' Returns up to limit paths of indexed files with base names equal
+        to the one of name ignoring case, or the closest ones, shortest first.
+        Compares name with all the indexed names, so it's slow on large
+        trees. '''
+        base_name = os.path.basename(name)
+        lower_name = base_name.lower()
+        # Files may be added from the UI thread meanwhile.
+        names = list(self.by_name)
+        matches = [other for other in names if other.lower() == lower_name] \
+            or get_close_matches(base_name, names, limit, self.FUZZY_CUTOFF)
+        paths = [self.get_path(file_id) for match in matches
+                 for file_id in self.by_name[match]]
+        paths.sort(key=len)
+        return paths[:limit]
+
+    def get_related(self, path, includers=False):
+        ''' Returns sorted paths of files included by path, or including it. '''
+        file_id = self.get_id(path)
+        if file_id is None:
+            return []
+        table = self.includers if includers else self.includes
+        return sorted(set(self.get_path(i) for i in table.get(file_id, ())))
+
+
+class FileIndex(BackgroundIndex):
+    ''' Files under a window's folders and absolute search paths, with the
+    include graph of C/C++ sources, built by an external process. '''
+
+    fileindex = ExternalPythonCaller('fileindex', persistent=True)
+
+    # Indexes by window id.
+    indexes = {}
+
+    table = None
+
+    @classmethod
+    def get(cls, window):
+        ''' Returns index of the window, dropping those of closed windows. '''
+        window_ids = set(open_window.id() for open_window in windows())
+        for window_id in list(cls.indexes):
+            if window_id not in window_ids:
+                del cls.indexes[window_id]
+        index = cls.indexes.get(window.id())
+        if index is None:
+            index = cls.indexes[window.id()] = cls()
+        return index
+
+    @classmethod
+    def get_for(cls, view):
+        ''' Returns index of the view's window, refreshing it if needed. '''
+        index = cls.get(view.window())
+        search_dirs = [os.path.normpath(dir_name)
+                       for dir_name in get_search_paths(view)
+                       if os.path.isabs(dir_name)]
+        roots = []
+        for dir_name in search_dirs + view.window().folders():
+            dir_name = os.path.normpath(dir_name)
+            if dir_name not in roots:
+                roots.append(dir_name)
+        settings = view.settings()
+        index.refresh(roots, search_dirs,
+                      settings.get('folder_exclude_patterns', []),
+                      settings.get('file_exclude_patterns', []))
+        return index
+
+    def update(self, roots, search_dirs, folder_excludes, file_excludes):
+        dir_names, files, includes = self.fileindex.index(
+            roots, search_dirs, folder_excludes, file_excludes)
+        self.table = FileTable(roots, dir_names, files, includes)
+
+
+class FileIndexListener(EventListener):
+    def on_post_save(self, view):
+        stat_cache.forget(view.file_name())
+        window = view.window()
+        if window is None or window.id() not in FileIndex.indexes:
+            return
+        table = FileIndex.indexes[window.id()].table
+        if table is not None:
+            table.add(view.file_name())
+
+    def on_close(self, view):
+        # The file may have been deleted or renamed, let the next lookup
+        # rebuild the index without waiting for the refresh interval.
+        for index in FileIndex.indexes.itervalues():
+            index.refreshed_at = None
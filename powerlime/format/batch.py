@@ -0,0 +1,196 @@
+''' Headless driver applying editor formatters to whole trees of files. '''
+import difflib
+import json
+import os
+import os.path
+import sys
+
+from argparse import ArgumentParser
+from fnmatch import fnmatch
+from hashlib import md5
+from multiprocessing import Pool, cpu_count
+from time import time
+
+# Number of files sent to a worker process at once.
+CHUNK_SIZE = 8
+
+transform = None
+
+
+def init_worker(factory, settings):
+    global transform
+    transform = factory(settings)
+
+
+def process_file((path, check, diff)):
+    ''' Formats a single file, returns path, digest of the formatted contents,
+    whether the file needs changes, the diff and the file size. '''
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except IOError as e:
+        return path, None, False, str(e), 0
+
+    try:
+        text = data.decode('utf-8')
+    except UnicodeDecodeError:
+        return path, None, False, 'not UTF-8 encoded', len(data)
+
+    # Formatters produce LF line endings, like the editor buffers.
+    crlf = '\r\n' in text
+    if crlf:
+        text = text.replace('\r\n', '\n')
+    new_text = transform(text)
+    changed = new_text != text
+    if not changed:
+        return path, md5(data).hexdigest(), False, None, len(data)
+
+    diff_text = None
+    if diff:
+        diff_text = ''.join(difflib.unified_diff(
+            text.splitlines(True), new_text.splitlines(True),
+            path, path)).encode('utf-8')
+    if crlf:
+        new_text = new_text.replace('\n', '\r\n')
+    new_data = new_text.encode('utf-8')
+    if check or diff:
+        return path, None, True, diff_text, len(data)
+
+    with open(path, 'wb') as f:
+        f.write(new_data)
+    return path, md5(new_data).hexdigest(), True, diff_text, len(data)
+
+
+def collect_files(paths, extensions, excludes):
+    def is_excluded(name):
+        return any(fnmatch(name, pattern) for pattern in excludes)
+
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+        for dir_path, dir_names, file_names in os.walk(path):
+            dir_names[:] = sorted(name for name in dir_names
+                                  if not is_excluded(name))
+            for name in sorted(file_names):
+                if name.endswith(extensions) and not is_excluded(name):
+                    files.append(os.path.join(dir_path, name))
+    return files
+
+
+def get_source_digest():
+    ''' Returns digest of the formatters' source files, so that hashes cached
+    by an older version of them are not trusted. '''
+    digest = md5()
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in sorted(os.listdir(package_dir)):
+        if name.endswith('.py'):
+            with open(os.path.join(package_dir, name), 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def load_json(path, default):
+    if path is None or not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+
+def run(description, extensions, factory, settings_keys, argv=None):
+    ''' Runs factory(settings) transforms over files given on the command
+    line, in a process pool. settings_keys are the view settings read from the
+    config file. Returns the exit status. '''
+    parser = ArgumentParser(description=description)
+    parser.add_argument('paths', nargs='+', help='files or directories')
+    parser.add_argument('--config', help='JSON file with view settings: ' +
+                        ', '.join(settings_keys))
+    parser.add_argument('--check', action='store_true',
+                        help="report files needing changes, don't write")
+    parser.add_argument('--diff', action='store_true',
+                        help="print changes as unified diffs, don't write")
+    parser.add_argument('--cache', default='.powerlime-format-cache',
+                        help='file with hashes of already formatted files')
+    parser.add_argument('--no-cache', dest='cache', action='store_const',
+                        const=None, help="don't skip unchanged files")
+    parser.add_argument('--exclude', action='append', default=[],
+                        help='file or directory name pattern to skip')
+    parser.add_argument('-j', '--jobs', type=int, default=cpu_count(),
+                        help='number of worker processes')
+    args = parser.parse_args(argv)
+    if args.config is not None and not os.path.exists(args.config):
+        parser.error('config file {0} not found'.format(args.config))
+
+    config = load_json(args.config, {})
+    settings = dict((key, config[key]) for key in settings_keys
+                    if key in config)
+
+    # Hashes are only valid for the settings and formatters they were
+    # computed with.
+    settings_digest = md5(json.dumps(settings, sort_keys=True) +
+                          get_source_digest()).hexdigest()
+    cache = load_json(args.cache, {})
+    if cache.get('settings') != settings_digest:
+        cache = {'settings': settings_digest, 'files': {}}
+    digests = cache['files']
+
+    start = time()
+    files = collect_files(args.paths, extensions, args.exclude)
+    tasks = []
+    skipped = 0
+    for path in files:
+        digest = digests.get(path)
+        if digest is not None:
+            try:
+                with open(path, 'rb') as f:
+                    if md5(f.read()).hexdigest() == digest:
+                        skipped += 1
+                        continue
+            except IOError:
+                pass
+        tasks.append((path, args.check, args.diff))
+
+    changed = 0
+    errors = 0
+    size = 0
+    pool = Pool(max(args.jobs, 1), init_worker, (factory, settings))
+    try:
+        for path, digest, needs_change, message, file_size in \
+                pool.imap(process_file, tasks, CHUNK_SIZE):
+            size += file_size
+            if digest is None and not needs_change:
+                errors += 1
+                sys.stderr.write('{0}: {1}\n'.format(path, message))
+                continue
+            if needs_change:
+                changed += 1
+                if args.diff:
+                    sys.stdout.write(message)
+                elif args.check:
+                    print 'would reformat {0}'.format(path)
+                else:
+                    print 'reformatted {0}'.format(path)
+            if digest is not None:
+                digests[path] = digest
+            else:
+                digests.pop(path, None)
+    finally:
+        pool.close()
+        pool.join()
+
+    if args.cache is not None:
+        with open(args.cache, 'w') as f:
+            json.dump(cache, f)
+
+    elapsed = max(time() - start, 1e-6)
+    sys.stderr.write(
+        '{0} files ({1} unchanged since the last run, {2} {3}, {4} errors) '
+        'in {5:.2f}s: {6:.0f} files/s, {7:.2f} MB/s\n'.format(
+            len(files), skipped, changed,
+            'to change' if args.check or args.diff else 'changed', errors,
+            elapsed, len(tasks) / elapsed, size / elapsed / (1 << 20)))
+
+    if errors or (changed and (args.check or args.diff)):
+        return 1
+    return 0
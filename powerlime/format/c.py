@@ -1,11 +1,11 @@
 from sublime import Region, status_message
 
-from powerlime.util import CxxSpecificCommand
+from powerlime.format.cincludes import INCLUDE_LINE_RE, scan_includes, \
+    sort_block
+from powerlime.util import CxxSpecificCommand, replace_lines
 
 
 class SortIncludesCommand(CxxSpecificCommand):
-    SELECTOR = 'meta.preprocessor.c.include'
-
     def run(self, edit):
         view = self.view
         sels = []
@@ -16,8 +16,7 @@ class SortIncludesCommand(CxxSpecificCommand):
         if sels:
             for sel in sels:
                 for line in view.lines(sel):
-                    if view.score_selector(line.a, self.SELECTOR) == 0 or \
-                            view.extract_scope(line.a) != line:
+                    if not INCLUDE_LINE_RE.match(view.substr(line)):
                         status_message('Error: selection contains non-includes')
                         return
             for sel in sels:
@@ -26,26 +25,13 @@ class SortIncludesCommand(CxxSpecificCommand):
             self.sort_all_includes(edit)
 
     def sort_all_includes(self, edit):
-        regions = self.view.find_by_selector(self.SELECTOR)
-        if not regions:
-            return
-
-        regions = iter(regions)
-        prev_region = next(regions)
-        a = prev_region.a
-        b = prev_region.b
-        for region in regions:
-            if prev_region.b + 1 != region.a or \
-                    self.view.substr(prev_region.b) != '\n':  # This feels unnecessary
-                self.sort_lines(edit, Region(a, b))
-                a = region.a
-            b = region.b
-            prev_region = region
-        self.sort_lines(edit, Region(a, b))
+        text = self.view.substr(Region(0, self.view.size()))
+        for start, end in reversed(scan_includes(text)):
+            self.sort_lines(edit, Region(start, end))
 
     def sort_lines(self, edit, region):
         view = self.view
-        lines = [view.substr(line) for line in view.lines(region)]
-        sorted_lines = sorted(lines)
-        if sorted_lines != lines:
-            view.replace(edit, region, u'\n'.join(sorted_lines))
+        text = view.substr(region)
+        sorted_text = sort_block(text)
+        if sorted_text != text:
+            replace_lines(view, edit, region, sorted_text)
@@ -0,0 +1,131 @@
+import os.path
+import re
+import sys
+
+from powerlime.format import batch
+
+
+INCLUDE_LINE_RE = re.compile(r'[ \t]*#[ \t]*include\b')
+
+# Finds include directives at line starts, skipping comments and literals.
+INCLUDE_SCAN_RE = re.compile(r'''
+    (?P<include>^[ \t]*\#[ \t]*include\b[^\n]*)
+  | /\*.*?(?:\*/|\Z)
+  | //[^\n]*
+  | "(?:[^"\\\n]|\\.)*"
+  | '(?:[^'\\\n]|\\.)*'
+''', re.M | re.S | re.X)
+
+INCLUDE_NAME_RE = re.compile(r'[ \t]*#[ \t]*include[ \t]*[<"]([^>"\n]+)[>"]')
+
+CXX_EXTENSIONS = ('.c', '.cc', '.cpp', '.cxx', '.h', '.hh', '.hpp', '.hxx',
+                  '.inl', '.m', '.mm')
+
+
+def scan_includes(text):
+    ''' Returns (start, end) offsets of blocks of consecutive include lines in
+    C/C++ source text, without the final newline.
+
+    Any other line ends a block, in particular conditional directives, so
+    includes are never moved across #if/#endif boundaries. Include lines
+    continued with a backslash or opening a multi-line comment are left out.
+    '''
+    blocks = []
+    block = None
+    pos = 0
+    while True:
+        match = INCLUDE_SCAN_RE.search(text, pos)
+        if match is None:
+            break
+        pos = match.end()
+        if match.lastgroup != 'include':
+            continue
+
+        start, end = match.span()
+        line = match.group()
+        sortable = True
+        if text[max(start - 2, 0):start] == '\\\n' or \
+                text[max(start - 3, 0):start] == '\\\r\n':
+            # A continuation of the previous line, not a directive.
+            continue
+        if line.rstrip().endswith('\\'):
+            sortable = False
+        comment = line.rfind('/*')
+        if comment != -1 and line.find('*/', comment) == -1:
+            # Let the comment be skipped as a whole.
+            pos = start + comment
+            sortable = False
+
+        if not sortable:
+            block = None
+        elif block is not None and block[1] + 1 == start:
+            block = blocks[-1] = (block[0], end)
+        else:
+            block = (start, end)
+            blocks.append(block)
+    return blocks
+
+
+def find_include_names(text):
+    ''' Returns names of files included in C/C++ source text. '''
+    names = []
+    for match in INCLUDE_SCAN_RE.finditer(text):
+        if match.lastgroup == 'include':
+            name = INCLUDE_NAME_RE.match(match.group())
+            if name is not None:
+                names.append(name.group(1))
+    return names
+
+
+def resolve_include(name, dirs, ids, by_name, paths):
+    ''' Returns id of the file name resolves to, looking in dirs first and
+    then for any path ending with name, or None.
+
+    ids maps normalized absolute paths to ids, by_name maps base names to
+    lists of ids and paths holds paths by id.
+    '''
+    name = os.path.normpath(name)
+    for dir_name in dirs:
+        path_id = ids.get(os.path.normpath(os.path.join(dir_name, name)))
+        if path_id is not None:
+            return path_id
+
+    suffix = os.sep + name
+    for path_id in by_name.get(os.path.basename(name), ()):
+        if paths[path_id].endswith(suffix):
+            return path_id
+    return None
+
+
+def sort_block(text):
+    lines = text.split(u'\n')
+    return u'\n'.join(sorted(lines))
+
+
+def sort_includes(text):
+    ''' Returns text with lines of all include blocks sorted, the same way
+    SortIncludesCommand does. '''
+    parts = []
+    pos = 0
+    for start, end in scan_includes(text):
+        parts.append(text[pos:start])
+        parts.append(sort_block(text[start:end]))
+        pos = end
+    parts.append(text[pos:])
+    return u''.join(parts)
+
+
+def make_transform(settings):
+    return sort_includes
+
+
+def main(argv=None):
+    return batch.run('Sort C/C++ include blocks the way the Sort Includes '
+                     'command does.', CXX_EXTENSIONS, make_transform, (),
+                     argv)
+
+
+if __name__ == '__main__':
+    # Import by name, so that worker processes can unpickle make_transform.
+    from powerlime.format.cincludes import main
+    sys.exit(main())
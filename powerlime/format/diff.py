@@ -0,0 +1,21 @@
+from difflib import SequenceMatcher
+
+
+def line_hunks(old_text, new_text):
+    ''' Returns (start, end, text) replacements of whole lines turning
+    old_text into new_text. Offsets are into old_text, last hunk first, so
+    that applying them in order doesn't shift the remaining ones. '''
+    old_lines = old_text.splitlines(True)
+    new_lines = new_text.splitlines(True)
+    offsets = [0]
+    for line in old_lines:
+        offsets.append(offsets[-1] + len(line))
+
+    hunks = []
+    matcher = SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag != 'equal':
+            hunks.append((offsets[i1], offsets[i2],
+                          u''.join(new_lines[j1:j2])))
+    hunks.reverse()
+    return hunks
@@ -0,0 +1,472 @@
+import ast
+import re
+import sys
+
+from collections import namedtuple
+from functools import partial
+
+from powerlime.format import batch
+
+
+# Module-level import statements found on consecutive lines, start and end
+# are character offsets of whole lines.
+ImportBlock = namedtuple('ImportBlock', 'start end stmts')
+
+
+class TokenStream(object):
+    ''' Tokens of a single logical line, consumed by the import parser. '''
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return None
+
+    def accept(self, string):
+        if self.peek() == string:
+            self.pos += 1
+            return True
+        return False
+
+    def name(self):
+        token = self.peek()
+        if token is None or not (token[0].isalpha() or token[0] == '_'):
+            raise ValueError('Expected a name')
+        self.pos += 1
+        return token
+
+    def dotted_name(self):
+        parts = [self.name()]
+        while self.accept('.'):
+            parts.append(self.name())
+        return '.'.join(parts)
+
+    def alias(self, name):
+        if self.accept('as'):
+            return ast.alias(name=name, asname=self.name())
+        return ast.alias(name=name, asname=None)
+
+
+def parse_import(stream):
+    if stream.accept('import'):
+        names = [stream.alias(stream.dotted_name())]
+        while stream.accept(','):
+            names.append(stream.alias(stream.dotted_name()))
+        return ast.Import(names=names)
+
+    if not stream.accept('from'):
+        raise ValueError('Expected an import')
+    level = 0
+    while stream.accept('.'):
+        level += 1
+    module = None
+    if not level or stream.peek() != 'import':
+        module = stream.dotted_name()
+    if not stream.accept('import'):
+        raise ValueError('Expected import')
+
+    if stream.accept('*'):
+        names = [ast.alias(name='*', asname=None)]
+    else:
+        paren = stream.accept('(')
+        names = [stream.alias(stream.name())]
+        while stream.accept(','):
+            if paren and stream.peek() == ')':
+                break
+            names.append(stream.alias(stream.name()))
+        if paren and not stream.accept(')'):
+            raise ValueError('Expected )')
+    return ast.ImportFrom(module=module, names=names, level=level)
+
+
+def parse_import_line(tokens):
+    ''' Returns statements of a logical line holding only imports, or None. '''
+    stream = TokenStream(tokens)
+    stmts = []
+    try:
+        while True:
+            stmts.append(parse_import(stream))
+            if not stream.accept(';') or stream.peek() is None:
+                break
+    except ValueError:
+        return None
+    if stream.peek() is not None:
+        return None
+    return stmts
+
+
+# Tokens of import statements: blanks and line continuations (no group),
+# names and operators, comments, newlines and anything else.
+IMPORT_TOKEN_RE = re.compile(r'[ \t\f]+|\\\r?\n|(\w+|[.,*();])|(\#)|(\r?\n)|(.)')
+IMPORT_TOKEN, IMPORT_COMMENT, IMPORT_NEWLINE, IMPORT_OTHER = range(1, 5)
+
+
+# Common single-line imports, parsed without tokenizing: dotted names with
+# aliases, or a module and names with aliases.
+IMPORT_NAMES = r'{0}(?:[ \t]+as[ \t]+{1})?(?:[ \t]*,[ \t]*{0}(?:[ \t]+as[ \t]+{1})?)*'
+NAME = r'[a-zA-Z_]\w*'
+DOTTED_NAME = r'{0}(?:\.{0})*'.format(NAME)
+SIMPLE_IMPORT_RE = re.compile(r'import[ \t]+({0})[ \t]*(?:\r?\n|\Z)'.format(
+    IMPORT_NAMES.format(DOTTED_NAME, NAME)))
+SIMPLE_FROM_IMPORT_RE = re.compile(
+    r'from[ \t]+(\.*)({0})?[ \t]+import[ \t]+({1})[ \t]*(?:\r?\n|\Z)'.format(
+        DOTTED_NAME, IMPORT_NAMES.format(NAME, NAME)))
+
+
+def parse_aliases(text):
+    ''' Returns ast.aliases of names already matched by IMPORT_NAMES. '''
+    aliases = []
+    for part in text.split(','):
+        words = part.split()
+        aliases.append(ast.alias(name=words[0],
+                                 asname=words[2] if len(words) > 1 else None))
+    return aliases
+
+
+def parse_simple_import(text, pos):
+    ''' Returns end offset and statement of a single-line import without
+    parentheses, continuations or semicolons at pos, or None. '''
+    if text.startswith('import', pos):
+        match = SIMPLE_IMPORT_RE.match(text, pos)
+        if match is not None:
+            return match.end(), ast.Import(names=parse_aliases(match.group(1)))
+        return None
+    match = SIMPLE_FROM_IMPORT_RE.match(text, pos)
+    if match is not None and (match.group(1) or match.group(2)):
+        return match.end(), ast.ImportFrom(
+            module=match.group(2), names=parse_aliases(match.group(3)),
+            level=len(match.group(1)))
+    return None
+
+
+def scan_block(text, start):
+    ''' Returns end offset and statements of consecutive import lines
+    starting at start. '''
+    end = start
+    stmts = []
+    line = []
+    depth = 0
+    pos = start
+    while True:
+        if not line:
+            simple = parse_simple_import(text, pos)
+            if simple is not None:
+                end = pos = simple[0]
+                stmts.append(simple[1])
+                if pos >= len(text):
+                    break
+                continue
+
+        match = IMPORT_TOKEN_RE.match(text, pos)
+        if match is None or (match.lastindex == IMPORT_NEWLINE and
+                             not depth):
+            # End of a logical line, blank lines end blocks.
+            if not line:
+                break
+            line_stmts = parse_import_line(line)
+            if line_stmts is None:
+                break
+            stmts.extend(line_stmts)
+            if match is None:
+                end = len(text)
+                break
+            end = pos = match.end()
+            line = []
+            continue
+
+        pos = match.end()
+        kind = match.lastindex
+        if kind is None:
+            # Indented lines are not module-level.
+            if not line:
+                break
+        elif kind == IMPORT_TOKEN:
+            token = match.group(kind)
+            if token == '(':
+                depth += 1
+            elif token == ')':
+                depth -= 1
+            line.append(token)
+        elif kind != IMPORT_NEWLINE:
+            # Comments would be lost by formatting, anything else is not an
+            # import.
+            break
+    return end, stmts
+
+
+# Lines beginning with an import statement, the newline comes first so that
+# the search only stops at line ends.
+IMPORT_START_RE = re.compile(r'\n(?:import|from)\b')
+
+# Single-quoted string literals, unterminated ones run to the end of the line.
+STRING_RE = re.compile(r"""
+    '[^'\\\n]*(?:\\.[^'\\\n]*)*'?
+  | "[^"\\\n]*(?:\\.[^"\\\n]*)*"?
+""", re.X)
+
+
+class LiteralSkipper(object):
+    ''' Steps forward over string literals and comments in text.
+
+    Literals are found with str.find, which is several times faster than
+    searching with a regex, and the next offset of each character starting
+    them is kept between calls, so characters missing from the text are not
+    searched for again and again.
+    '''
+
+    def __init__(self, text):
+        self.text = text
+        self.pos = 0
+        # Offsets of the next '"', "'" and '#' from pos, len(text) if none.
+        self.quote = self.apostrophe = self.comment = -1
+
+    def skip_to(self, limit):
+        ''' Moves forward to limit, which must not be before the current
+        position. Returns limit, or the end of a literal spanning over it. '''
+        text = self.text
+        find = text.find
+        size = len(text)
+        pos = self.pos
+        quote, apostrophe, comment = self.quote, self.apostrophe, self.comment
+        while True:
+            if quote < pos:
+                quote = find('"', pos)
+                if quote == -1:
+                    quote = size
+            if apostrophe < pos:
+                apostrophe = find("'", pos)
+                if apostrophe == -1:
+                    apostrophe = size
+            if comment < pos:
+                comment = find('#', pos)
+                if comment == -1:
+                    comment = size
+            start = min(quote, apostrophe, comment)
+            if start >= limit:
+                pos = limit
+                break
+
+            if start == comment:
+                pos = find('\n', start)
+                if pos == -1:
+                    pos = size
+            else:
+                delimiter = text[start] * 3
+                if text.startswith(delimiter, start):
+                    pos = self.find_closing_quotes(delimiter, start + 3)
+                else:
+                    pos = STRING_RE.match(text, start).end()
+            if pos > limit:
+                break
+
+        self.pos = pos
+        self.quote, self.apostrophe, self.comment = quote, apostrophe, comment
+        return pos
+
+    def find_closing_quotes(self, delimiter, pos):
+        ''' Returns end of the triple-quoted string with contents from pos. '''
+        text = self.text
+        while True:
+            end = text.find(delimiter, pos)
+            if end == -1:
+                return len(text)
+            escape = end
+            while text[escape - 1] == '\\':
+                escape -= 1
+            if (end - escape) % 2 == 0:
+                return end + 3
+            pos = end + 1
+
+
+def scan_imports(text):
+    ''' Returns ImportBlocks of module-level imports in Python source text.
+
+    Lines starting with import or from are found with a single regex search.
+    String literals and comments are only stepped over up to the last such
+    line, to leave out the ones inside docstrings. Import lines with comments
+    are left out, as formatting would drop them.
+    '''
+    blocks = []
+    skipper = LiteralSkipper(text)
+    starts = [match.start() + 1 for match in IMPORT_START_RE.finditer(text)]
+    if text.startswith(('import', 'from')):
+        starts.insert(0, 0)
+    for start in starts:
+        if start < skipper.pos or text[max(start - 2, 0):start] == '\\\n':
+            continue
+        if skipper.skip_to(start) > start:
+            continue
+        end, stmts = scan_block(text, start)
+        if stmts:
+            blocks.append(ImportBlock(start, end, stmts))
+            skipper.skip_to(end)
+    return blocks
+
+
+def try_parse(src):
+    try:
+        return ast.parse(src)
+    except (SyntaxError, TypeError):
+        return None
+
+
+class PythonImportFormatter(object):
+    ''' Sorts Python imports '''
+
+    def __init__(self, settings):
+        rulers = settings.get('rulers')
+        if rulers is not None:
+            if settings.get('translate_tabs_to_spaces'):
+                self.indent = ' '
+            else:
+                self.indent = '\t'
+            self.indent *= settings.get('tab_size', 4)
+            self.wrap_at = min(rulers)
+        else:
+            self.indent = ' '
+            self.wrap_at = float('inf')
+        self.min_group_size = settings.get('pwl_sort_py_imports_group', 2) or \
+                float('inf')
+        self.split_by_type = True
+
+    def append_aliases(self, aliases, start_pos):
+        pos = start_pos
+        parts = self.parts
+        for i, alias in enumerate(aliases):
+            if alias.asname is None:
+                atom = alias.name
+            else:
+                atom = u'{0} as {1}'.format(alias.name, alias.asname)
+            if i + 1 < len(aliases):
+                atom += ', '
+                more = 1
+            else:
+                more = 0
+
+            if pos + len(atom) + more > self.wrap_at:
+                parts.append('\\\n')
+                if self.indent == ' ':
+                    parts.append(' ' * start_pos)
+                else:
+                    parts.append(self.indent)
+                pos = len(parts[-1])
+
+            parts.append(atom)
+            pos += len(atom)
+
+        parts.append('\n')
+        return u', '.join(parts)
+
+    def append_import(self, imp):
+        self.parts.append('import ')
+        self.append_aliases(imp.names, len(self.parts[-1]))
+
+    def append_from_import(self, imp):
+        self.parts.append('from {0} import '.format(
+                '.' * imp.level + (imp.module or '')))
+        self.append_aliases(imp.names, len(self.parts[-1]))
+
+    def sort_aliases(self, aliases):
+        aliases.sort(key=lambda alias: alias.name)
+
+    def sort_imports(self, imports):
+        for imp in imports:
+            self.sort_aliases(imp.names)
+        imports.sort(key=lambda imp: imp.names[0].name)
+
+    def sort_from_imports(self, imports):
+        for imp in imports:
+            self.sort_aliases(imp.names)
+        imports.sort(key=lambda imp: (imp.level, imp.module))
+
+    def import_key(self, imp):
+        if len(imp.names) == 1:
+            return imp.names[0].name.split('.', 1)[0]
+        else:
+            return None
+
+    def from_import_key(self, imp):
+        return imp.level, (imp.module or '').split('.', 1)[0]
+
+    def append_grouped(self, imports, appender, keyfunc):
+        def flush():
+            if group_size >= self.min_group_size and group_start is not None:
+                self.parts.insert(group_start, '\n')
+
+        key = None
+        group_size = 0
+        for imp in imports:
+            new_key = keyfunc(imp)
+            if key != new_key:
+                flush()
+                key = new_key
+                if group_size >= self.min_group_size:
+                    self.parts.append('\n')
+                    group_start = None
+                else:
+                    group_start = len(self.parts)
+                group_size = 1
+            else:
+                group_size += 1
+            appender(imp)
+        flush()
+
+    def format(self, stmts):
+        self.parts = []
+
+        imports = []
+        from_imports = []
+        for stmt in stmts:
+            if isinstance(stmt, ast.Import):
+                imports.append(stmt)
+            elif isinstance(stmt, ast.ImportFrom):
+                from_imports.append(stmt)
+            else:
+                raise ValueError('Unsupported statement type')
+
+        self.sort_imports(imports)
+        self.sort_from_imports(from_imports)
+
+        self.append_grouped(imports, self.append_import, self.import_key)
+        if self.split_by_type and imports and from_imports:
+            self.parts.append('\n')
+        self.append_grouped(from_imports, self.append_from_import,
+                            self.from_import_key)
+        return u''.join(self.parts)
+
+
+def format_imports(text, formatter):
+    ''' Returns text with all module-level import blocks formatted, the same
+    way SortPythonImportsCommand does. '''
+    parts = []
+    pos = 0
+    for block in scan_imports(text):
+        parts.append(text[pos:block.start])
+        parts.append(formatter.format(block.stmts))
+        pos = block.end
+    parts.append(text[pos:])
+    return u''.join(parts)
+
+
+# View settings used by PythonImportFormatter.
+FORMATTER_SETTINGS = ('rulers', 'translate_tabs_to_spaces', 'tab_size',
+                      'pwl_sort_py_imports_group')
+
+
+def make_transform(settings):
+    return partial(format_imports, formatter=PythonImportFormatter(settings))
+
+
+def main(argv=None):
+    return batch.run('Sort module-level Python imports the way the Sort '
+                     'Imports command does.', ('.py', ), make_transform,
+                     FORMATTER_SETTINGS, argv)
+
+
+if __name__ == '__main__':
+    # Import by name, so that worker processes can unpickle make_transform.
+    from powerlime.format.pyimports import main
+    sys.exit(main())
@@ -1,190 +1,169 @@
 import ast
 import re
 
+from bisect import bisect_left
 from collections import namedtuple
+from copy import deepcopy
+from hashlib import md5
+from time import time
 
-from sublime import Region, error_message, status_message
+from sublime import INHIBIT_WORD_COMPLETIONS, Region, error_message, \
+    status_message
 from sublime_plugin import EventListener
 
-from powerlime.util import PythonSpecificCommand
+from powerlime.format.pyimports import FORMATTER_SETTINGS, \
+    PythonImportFormatter, scan_imports, try_parse
+from powerlime.util import BackgroundIndex, ExternalPythonCaller, \
+    PythonSpecificCommand, get_syntax_name, replace_lines
 
 
-IMPORT_START_RE = r'(?:from[ \t]+[\w.]+[ \t]+)?import[\ \t]+'
-IMPORT_PAREN_RE = r'\([^(#)]*\)[\ \t]*'
-IMPORT_ESC_RE = r'[^\\#\n]*(?:\\\n[^\\#\n]*)*'
+# A parsed group of imports, holding it's position within the file.
+ImportGroup = namedtuple('ImportGroup', 'region imports')
 
-# A block of consecutive module-level import lines.
-IMPORT_RE = r'^({0}(?:{1}|{2})\n)+'.format(IMPORT_START_RE, IMPORT_PAREN_RE,
-                                           IMPORT_ESC_RE)
 
+def get_preview(text):
+    parts = []
+    for line in text.splitlines():
+        parts.extend(line.split()[:2])
+        parts.append('(...)')
+    return u' '.join(parts)
 
-# Catches module name in <from module import ...> statement.
-FROM_IMPORT_CATCH_RE = r'^[ \t]*from[ \t]([\w.]+)[ \t]import[ \t]'
 
+class ImportCache(object):
+    ''' Module-level imports of a view, valid until the view changes. '''
 
-# A parsed group of imports, holding it's position within the file.
-ImportGroup = namedtuple('ImportGroup', 'region imports')
+    # Cached instances per view id.
+    caches = {}
 
+    def __init__(self, view):
+        self.change_count = view.change_count()
+        self.groups = []
 
-def try_parse(src):
-    try:
-        return ast.parse(src)
-    except (SyntaxError, TypeError):
-        return None
+        # Groups holding at least one "from" type import.
+        self.from_groups = []
 
+        # First "from" type import of each module, along with its group.
+        self.from_imports = {}
 
-class PythonImportFormatter(object):
-    ''' Sorts Python imports '''
+        # Previews of groups shown to the user, per group start.
+        self.previews = {}
 
-    def __init__(self, settings):
-        rulers = settings.get('rulers')
-        if rulers is not None:
-            if settings.get('translate_tabs_to_spaces'):
-                self.indent = ' '
-            else:
-                self.indent = '\t'
-            self.indent *= settings.get('tab_size', 4)
-            self.wrap_at = min(rulers)
-        else:
-            self.indent = ' '
-            self.wrap_at = float('inf')
-        self.min_group_size = settings.get('pwl_sort_py_imports_group', 2) or \
-                float('inf')
-        self.split_by_type = True
-
-    def append_aliases(self, aliases, start_pos):
-        pos = start_pos
-        parts = self.parts
-        for i, alias in enumerate(aliases):
-            if alias.asname is None:
-                atom = alias.name
-            else:
-                atom = u'{0} as {1}'.format(alias.name, alias.asname)
-            if i + 1 < len(aliases):
-                atom += ', '
-                more = 1
-            else:
-                more = 0
-
-            if pos + len(atom) + more > self.wrap_at:
-                parts.append('\\\n')
-                if self.indent == ' ':
-                    parts.append(' ' * start_pos)
-                else:
-                    parts.append(self.indent)
-                pos = len(parts[-1])
-
-            parts.append(atom)
-            pos += len(atom)
-
-        parts.append('\n')
-        return u', '.join(parts)
-
-    def append_import(self, imp):
-        self.parts.append('import ')
-        self.append_aliases(imp.names, len(self.parts[-1]))
-
-    def append_from_import(self, imp):
-        self.parts.append('from {0} import '.format(
-                '.' * imp.level + (imp.module or '')))
-        self.append_aliases(imp.names, len(self.parts[-1]))
-
-    def sort_aliases(self, aliases):
-        aliases.sort(key=lambda alias: alias.name)
-
-    def sort_imports(self, imports):
-        for imp in imports:
-            self.sort_aliases(imp.names)
-        imports.sort(key=lambda imp: imp.names[0].name)
-
-    def sort_from_imports(self, imports):
-        for imp in imports:
-            self.sort_aliases(imp.names)
-        imports.sort(key=lambda imp: (imp.level, imp.module))
-
-    def import_key(self, imp):
-        if len(imp.names) == 1:
-            return imp.names[0].name.split('.', 1)[0]
-        else:
-            return None
-
-    def from_import_key(self, imp):
-        return imp.level, (imp.module or '').split('.', 1)[0]
-
-    def append_grouped(self, imports, appender, keyfunc):
-        def flush():
-            if group_size >= self.min_group_size and group_start is not None:
-                self.parts.insert(group_start, '\n')
-
-        key = None
-        group_size = 0
-        for imp in imports:
-            new_key = keyfunc(imp)
-            if key != new_key:
-                flush()
-                key = new_key
-                if group_size >= self.min_group_size:
-                    self.parts.append('\n')
-                    group_start = None
-                else:
-                    group_start = len(self.parts)
-                group_size = 1
-            else:
-                group_size += 1
-            appender(imp)
-        flush()
-
-    def format(self, stmts):
-        self.parts = []
-
-        imports = []
-        from_imports = []
-        for stmt in stmts:
-            if isinstance(stmt, ast.Import):
-                imports.append(stmt)
-            elif isinstance(stmt, ast.ImportFrom):
-                from_imports.append(stmt)
-            else:
-                raise ValueError('Unsupported statement type')
+        text = view.substr(Region(0, view.size()))
+        for block in scan_imports(text):
+            group = ImportGroup(region=Region(block.start, block.end),
+                                imports=block.stmts)
+            self.groups.append(group)
+            for imp in group.imports:
+                if isinstance(imp, ast.ImportFrom):
+                    self.from_imports.setdefault(imp.module, (group, imp))
+                    if not self.from_groups or \
+                            self.from_groups[-1] is not group:
+                        self.from_groups.append(group)
+            self.previews[block.start] = get_preview(
+                text[block.start:block.end])
 
-        self.sort_imports(imports)
-        self.sort_from_imports(from_imports)
+    @classmethod
+    def get(cls, view):
+        cache = cls.caches.get(view.id())
+        if cache is None or cache.change_count != view.change_count():
+            cache = cls.caches[view.id()] = cls(view)
+        return cache
 
-        self.append_grouped(imports, self.append_import, self.import_key)
-        if self.split_by_type and imports and from_imports:
-            self.parts.append('\n')
-        self.append_grouped(from_imports, self.append_from_import,
-                            self.from_import_key)
-        return u''.join(self.parts)
+
+def find_import_groups(view):
+    ''' Returns ImportGroups of all module-level import blocks in view. '''
+    return ImportCache.get(view).groups
 
 
 class SortPythonImportsCommand(PythonSpecificCommand):
     ''' Sort Python imports '''
 
-    def run(self, edit):
+    # Digests of import blocks known to be sorted, along with change count of
+    # the view they were computed at, per view id.
+    sorted_blocks = {}
+
+    def run(self, edit, on_save=False):
         view = self.view
         formatter = PythonImportFormatter(view.settings())
+        if on_save:
+            self.sort_on_save(edit, formatter)
+            return
 
         # Must be sorted.
         regions = [view.full_line(sel)
                    for sel in view.sel() if not sel.empty()]
-        if not regions:
-            regions.extend(view.find_all(IMPORT_RE))
-        regions.reverse()
-
-        # Since regions starts from from the furthest one, replaces do not
-        # change addressing of the previous ones.
-        for region in regions:
-            text = view.substr(region)
-            ast = try_parse(text)
-            if ast is not None:
-                try:
-                    new_text = formatter.format(ast.body)
-                except ValueError:
-                    status_message('Error: selection contains non-imports')
-                else:
-                    if text != new_text:
-                        view.replace(edit, region, new_text)
+        if regions:
+            groups = []
+            for region in regions:
+                tree = try_parse(view.substr(region))
+                if tree is not None:
+                    groups.append(ImportGroup(region=region,
+                                              imports=tree.body))
+        else:
+            groups = find_import_groups(view)
+
+        # Since groups start from the furthest one, replaces do not change
+        # addressing of the previous ones.
+        for group in reversed(groups):
+            text = view.substr(group.region)
+            try:
+                # Formatting sorts the imports in place, keep the cached ones
+                # as they were parsed.
+                new_text = formatter.format(deepcopy(group.imports))
+            except ValueError:
+                status_message('Error: selection contains non-imports')
+            else:
+                if text != new_text:
+                    replace_lines(view, edit, group.region, new_text)
+
+    def sort_on_save(self, edit, formatter):
+        ''' Sorts all import blocks, skipping the ones unchanged since the
+        last run, unless it takes longer than the time budget. '''
+        start = time()
+        view = self.view
+        change_count, known = self.sorted_blocks.get(view.id(), (None, ()))
+        if change_count == view.change_count():
+            return
+
+        settings = view.settings()
+        budget = settings.get('pwl_sort_py_imports_on_save_budget', 100)
+        # Blocks sorted with other settings may need changes.
+        settings_key = repr([settings.get(key) for key in FORMATTER_SETTINGS])
+        edits = []
+        digests = set()
+        for group in find_import_groups(view):
+            text = view.substr(group.region)
+            digest = md5((settings_key + text).encode('utf-8')).digest()
+            if digest not in known:
+                new_text = formatter.format(deepcopy(group.imports))
+                if new_text != text:
+                    edits.append((group.region, new_text))
+                    digest = md5((settings_key + new_text).encode('utf-8')) \
+                        .digest()
+            digests.add(digest)
+
+            if (time() - start) * 1000 > budget:
+                status_message('Import sorting skipped, took over {0} ms'
+                               .format(budget))
+                return
+
+        # Apply from the furthest block, so that regions stay valid.
+        for region, new_text in reversed(edits):
+            replace_lines(view, edit, region, new_text)
+        self.sorted_blocks[view.id()] = (view.change_count(), digests)
+        status_message('Imports {0} in {1:.0f} ms'.format(
+            'sorted' if edits else 'checked', (time() - start) * 1000))
+
+
+class PythonImportsListener(EventListener):
+    def on_pre_save(self, view):
+        if view.settings().get('pwl_sort_py_imports_on_save') and \
+                get_syntax_name(view) == 'python':
+            view.run_command('sort_python_imports', {'on_save': True})
+
+    def on_close(self, view):
+        SortPythonImportsCommand.sorted_blocks.pop(view.id(), None)
+        ImportCache.caches.pop(view.id(), None)
 
 
 class AddPythonImportCommand(PythonSpecificCommand):
@@ -204,6 +183,12 @@ class AddPythonImportCommand(PythonSpecificCommand):
         else:
             text = ''
 
+        # Suggest the module the symbol is usually imported from.
+        module = import_stats.modules.get(text)
+        if module is not None:
+            text = u'{0} {1}'.format(module, text)
+        import_stats.refresh_for(view)
+
         # Ask the user for the import.
         input_view = view.window().show_input_panel('module and symbols:',
                                                     text,
@@ -228,75 +213,60 @@ class AddPythonImportCommand(PythonSpecificCommand):
             self.add_module_import(formatter, tokens[0])
 
     def format_imports(self, formatter, group, imp, symbols):
+        ''' Replaces group with its imports and symbols added to imp, which is
+        either one of them or a new one. Cached imports are left unchanged. '''
+        imports = deepcopy(group.imports)
+        if imp in group.imports:
+            imp = imports[group.imports.index(imp)]
+        else:
+            imports.append(imp)
         for symbol in symbols:
             imp.names.append(ast.alias(name=symbol, asname=None))
         edit = self.view.begin_edit()
-        self.view.replace(edit, group.region, formatter.format(group.imports))
+        replace_lines(self.view, edit, group.region,
+                      formatter.format(imports))
         self.view.end_edit(edit)
 
-    def get_preview(self, region):
-        parts = []
-        text = self.view.substr(region)
-        for line in text.splitlines():
-            parts.extend(line.split()[:2])
-            parts.append('(...)')
-        return u' '.join(parts)
-
     def add_from_import(self, formatter, module, symbols):
         symbols = set(symbols)
-        groups = []  # Groups of imports saved for user choice.
+        cache = ImportCache.get(self.view)
 
         # Search for existing import to update.
-        for region in self.view.find_all(IMPORT_RE):
-            imports = try_parse(self.view.substr(region))
-            if not imports:
-                continue
-
-            # Whether imports contain at least one "from" type import.
-            interesting_group = False
-            imports = imports.body
+        found = cache.from_imports.get(module)
+        if found is not None:
+            group, imp = found
+
+            # Discard already imported symbols.
+            to_remove = []
+            for alias in imp.names:
+                if alias.asname is None and alias.name in symbols:
+                    to_remove.append(alias.name)
+            symbols.difference_update(to_remove)
+            if symbols:
+                self.format_imports(formatter, group, imp, symbols)
+                if to_remove:
+                    status_message('Already imported: ' +
+                                   ', '.join(to_remove))
+            else:
+                status_message('Already imported')
+            return
 
-            # Search for import from specified module.
-            for imp in imports:
-                if isinstance(imp, ast.ImportFrom):
-                    if imp.module == module:
-                        # Discard already imported symbols.
-                        to_remove = []
-                        for alias in imp.names:
-                            if alias.asname is None and alias.name in symbols:
-                                to_remove.append(alias.name)
-                        symbols.difference_update(to_remove)
-                        if symbols:
-                            self.format_imports(formatter,
-                                                ImportGroup(region=region,
-                                                            imports=imports),
-                                                imp, symbols)
-                            if to_remove:
-                                status_message('Already imported: ' +
-                                               ', '.join(to_remove))
-                        else:
-                            status_message('Already imported')
-                        return
-                    interesting_group = True
-
-            if interesting_group:
-                groups.append(ImportGroup(region=region, imports=imports))
+        # Groups of imports saved for user choice.
+        groups = cache.from_groups[:]
 
         # Need to add new "from (...)" import, possibly ask the user where.
-        def add_new_import(group):
-            imp = ast.ImportFrom(module=module, level=0, names=[])
-            group.imports.append(imp)
-            return imp
+        def new_import():
+            return ast.ImportFrom(module=module, level=0, names=[])
 
         if len(groups) > 1:
             # Let the user choose which group to add to.
             def handle_group_choice(index):
                 if index != -1:
-                    imp = add_new_import(groups[index])
-                    self.format_imports(formatter, groups[index], imp, symbols)
+                    self.format_imports(formatter, groups[index],
+                                        new_import(), symbols)
 
             self.view.window().show_quick_panel(
-                    [self.get_preview(group.region) for group in groups],
+                    [cache.previews[group.region.a] for group in groups],
                     handle_group_choice)
         else:
             # Add import to the last group.
@@ -308,8 +278,7 @@ class AddPythonImportCommand(PythonSpecificCommand):
                     region = Region(0, 0)
                 groups.append(ImportGroup(region=region, imports=[]))
 
-            imp = add_new_import(groups[-1])
-            self.format_imports(formatter, groups[-1], imp, symbols)
+            self.format_imports(formatter, groups[-1], new_import(), symbols)
 
     # def add_module_import(self, module):
     #     groups = []
@@ -342,18 +311,77 @@ class AddPythonImportCommand(PythonSpecificCommand):
     #                 handle_group_choice)
 
 
+class ModuleIndex(BackgroundIndex):
+    ''' Sorted names of modules importable in the project. '''
+
+    modindex = ExternalPythonCaller('modindex', persistent=True)
+
+    names = []
+
+    def update(self, folders):
+        self.names = self.modindex.list_modules(folders)
+
+    def complete(self, prefix, limit):
+        ''' Returns up to limit module names starting with prefix. '''
+        names = self.names
+        start = bisect_left(names, prefix)
+        end = bisect_left(names, prefix + u'\uffff', start)
+        return names[start:min(end, start + limit)]
+
+
+class ImportStats(BackgroundIndex):
+    ''' Modules symbols are most often imported from in the project. '''
+
+    importstats = ExternalPythonCaller('importstats', persistent=True)
+
+    modules = {}
+
+    def update(self, folders, folder_excludes, file_excludes):
+        self.modules = self.importstats.update(folders, folder_excludes,
+                                               file_excludes)
+
+    def refresh_for(self, view):
+        settings = view.settings()
+        self.refresh(view.window().folders(),
+                     settings.get('folder_exclude_patterns', []),
+                     settings.get('file_exclude_patterns', []))
+
+
+module_index = ModuleIndex()
+import_stats = ImportStats()
+
+
 class PythonAddImportCompletion(EventListener):
     view_id = None
 
+    MAX_COMPLETIONS = 100
+
     @classmethod
     def on_query_completions(cls, view, prefix, locations):
         if view.id() != cls.view_id:
             return
 
-        modules = []
-        cls.src_view.find_all(FROM_IMPORT_CATCH_RE, 0, r'\1', modules)
-        print modules
-        return [(module, module + ' ') for module in modules]
+        # Only the module name, which comes first, is completed.
+        text = view.substr(Region(0, locations[0])).lstrip()
+        if not re.match(r'[\w.]*$', text):
+            return []
+
+        # Modules imported in the source view go first.
+        modules = [module
+                   for module in ImportCache.get(cls.src_view).from_imports
+                   if module is not None and module.startswith(text)]
+        modules.sort()
+        imported = set(modules)
+        modules.extend(module
+                       for module in module_index.complete(text,
+                                                           cls.MAX_COMPLETIONS)
+                       if module not in imported)
+
+        # Completions replace the prefix, which is the last part of the
+        # dotted name.
+        start = len(text) - len(prefix)
+        return ([(module, module[start:] + ' ') for module in modules],
+                INHIBIT_WORD_COMPLETIONS)
 
     @classmethod
     def on_close(cls, view):
@@ -365,3 +393,4 @@ class PythonAddImportCompletion(EventListener):
     def enable_completions(cls, view, src_view):
         cls.view_id = view.id()
         cls.src_view = src_view
+        module_index.refresh(src_view.window().folders())
@@ -1,19 +1,89 @@
 from __future__ import division
 
 
+import os.path
+
 import sublime
 
+from functools import partial
+from time import time
 from urllib import urlencode
 from urlparse import SplitResult, parse_qs, urlsplit, urlunsplit
 
 from powerlime.help.base import SelectionCommand
-from powerlime.util import ExternalPythonCaller, HaskellSpecificCommand
+from powerlime.util import ExternalCallError, ExternalPythonCaller, \
+    HaskellSpecificCommand, PanelSearch, async_worker
+
+
+class HoogleSearch(PanelSearch):
+    ''' Streams results of a Hoogle web query into the quick panel.
+
+    The panel is shown shortly after the first results arrive, and re-shown
+    with the complete list once the query finishes, if it's still open.
+    '''
+
+    # Delay in seconds between the first result and showing the panel.
+    SHOW_DELAY = 0.2
+
+    def __init__(self, command, url, cache, internal, get_doc, prefetch):
+        PanelSearch.__init__(self, command.view.window())
+        self.command = command
+        self.url = url
+        self.cache = cache
+        self.internal = internal
+        self.prefetch = prefetch
+        self.get_doc = get_doc
+        self.results = []
+        self.done = False
+        self.error = None
+        self.first_at = None
+        self.shown = 0
+
+    def start(self):
+        async_worker.execute(self.fetch)
+        self.poll()
+
+    def fetch(self):
+        hoogle = self.command.hoogle
+        try:
+            # Configured here, as the worker may still be streaming results
+            # of a previous query.
+            hoogle.configure(*self.cache)
+            for result in hoogle.query_index.iter(self.url, self.prefetch):
+                self.results.append(result)
+        except ExternalCallError as e:
+            self.error = e
+        self.done = True
+
+    def poll_results(self):
+        # Check for completion first, so that no results are missed.
+        done = self.done
+        count = len(self.results)
+        if count and self.first_at is None:
+            self.first_at = time()
+
+        if not self.shown:
+            if count and (done or time() - self.first_at >= self.SHOW_DELAY):
+                self.show(count)
+            elif done and self.error is not None:
+                sublime.error_message('Hoogle error: {0}'.format(self.error))
+            elif done:
+                sublime.status_message('Hoogle: nothing found')
+        elif done and self.panel_open and count > self.shown:
+            self.show(count)
+        return not done
+
+    def show(self, count):
+        self.shown = count
+        self.command.show_results(self.results[:count], self.internal,
+                                  self.get_doc, self.show_panel)
 
 
 class HoogleCommand(SelectionCommand, HaskellSpecificCommand):
     PROMPT = 'hoogle query'
 
-    hoogle = ExternalPythonCaller('hoogle')
+    hoogle = ExternalPythonCaller('hoogle', persistent=True, stream_batch=1)
+    hoogledb = ExternalPythonCaller('hoogledb', persistent=True)
 
     @staticmethod
     def add_query_args(url, args):
@@ -24,35 +94,96 @@ class HoogleCommand(SelectionCommand, HaskellSpecificCommand):
         return urlunsplit(SplitResult(**url))
 
     def handle(self, query, internal=True):
-        url = self.view.settings().get('hoogle_url',
-            'http://www.haskell.org/hoogle/')
-        url = self.add_query_args(url, {'hoogle': query})
-        results = self.hoogle.query_index(url)
-        if results is not None:
-            def on_select(index):
-                if index == -1:
-                    return
-
-                if internal:
-                    doc = self.hoogle.query_details(results[index]['url'])
-                    if doc is None:
-                        return
-                    output = win.get_output_panel('hoogle')
-                    output.set_read_only(False)
-                    edit = output.begin_edit()
-                    output.erase(edit, sublime.Region(0, output.size()))
-                    output.insert(edit, 0, doc)
-                    output.end_edit(edit)
-                    output.set_read_only(True)
-                    win.run_command('show_panel',
-                        {'panel': 'output.hoogle'})
-                else:
-                    win.run_command('open_url', {
-                        'url': results[index]['url']
-                    })
-
-            win = self.view.window()
-            win.show_quick_panel(
-                [[res['name'], res['loc'], res['url']] for res in results],
-                on_select
-            )
+        settings = self.view.settings()
+        database = settings.get('hoogle_database')
+        if database is not None:
+            self.query_local(settings, database, query, internal)
+        else:
+            url = settings.get('hoogle_url', 'http://www.haskell.org/hoogle/')
+            url = self.add_query_args(url, {'hoogle': query})
+            # Details of the top results are fetched in the background, so
+            # that showing them in the output panel is instant.
+            prefetch = settings.get('hoogle_prefetch', 5) if internal else 0
+            HoogleSearch(self, url, self.get_cache_args(settings), internal,
+                         self.get_details, prefetch).start()
+
+    def get_details(self, result):
+        return self.hoogle.query_details(result['url'])
+
+    def show_results(self, results, internal, get_doc, show_panel=None):
+        ''' Shows results in the quick panel, with show_panel if given. '''
+        def on_select(index):
+            if index == -1:
+                return
+
+            if internal:
+                # Details may have to be downloaded, and the worker may still
+                # be streaming results, so don't wait on the UI thread.
+                async_worker.execute(load_doc, results[index])
+            else:
+                win.run_command('open_url', {
+                    'url': results[index]['url']
+                })
+
+        def load_doc(result):
+            try:
+                doc = get_doc(result)
+            except ExternalCallError as e:
+                sublime.set_timeout(partial(sublime.error_message,
+                    'Hoogle error: {0}'.format(e)), 0)
+                return
+            if doc is not None:
+                sublime.set_timeout(partial(show_doc, doc), 0)
+
+        def show_doc(doc):
+            output = win.get_output_panel('hoogle')
+            output.set_read_only(False)
+            edit = output.begin_edit()
+            output.erase(edit, sublime.Region(0, output.size()))
+            output.insert(edit, 0, doc)
+            output.end_edit(edit)
+            output.set_read_only(True)
+            win.run_command('show_panel',
+                {'panel': 'output.hoogle'})
+
+        win = self.view.window()
+        (show_panel or win.show_quick_panel)(
+            [[res['name'], res['loc'], res['url']] for res in results],
+            on_select
+        )
+
+    def get_cache_args(self, settings):
+        ''' Returns arguments of the Hoogle worker's configure, pointing it at
+        the on-disk page cache. '''
+        cache_dir = settings.get('hoogle_cache_dir')
+        if cache_dir is None:
+            cache_dir = os.path.join(sublime.packages_path(), 'User',
+                                     'PowerLime.hoogle-cache')
+        return cache_dir or None, settings.get('hoogle_cache_ttl', 3600)
+
+    def query_local(self, settings, database, query, internal):
+        ''' Searches local Hoogle text databases in the background, as the
+        first query may have to index them. '''
+        if isinstance(database, basestring):
+            database = [database]
+        index_path = settings.get('hoogle_index')
+        if index_path is None:
+            index_path = os.path.join(sublime.packages_path(), 'User',
+                                      'PowerLime.hoogle-index')
+
+        def search():
+            try:
+                results = self.hoogledb.query(database, index_path, query)
+            except ExternalCallError as e:
+                sublime.set_timeout(partial(sublime.error_message,
+                    'Hoogle database error: {0}'.format(e)), 0)
+                return
+            if not results:
+                sublime.set_timeout(partial(sublime.status_message,
+                                            'Hoogle: nothing found'), 0)
+                return
+            sublime.set_timeout(partial(self.show_results, results, internal,
+                                        lambda result: result['doc']), 0)
+
+        sublime.status_message('Hoogle: searching...')
+        async_worker.execute(search)
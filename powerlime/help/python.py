@@ -1,25 +1,245 @@
 from __future__ import division
 
+import mmap
 import os
 import os.path
 import re
+import struct
+import zlib
 
+from bisect import bisect_left
 from functools import partial
-from subprocess import PIPE, Popen
+from hashlib import md5
+from heapq import nlargest
+from itertools import izip
+from threading import Lock
 
 from sublime import MONOSPACE_FONT, Region, active_window, error_message, \
-    message_dialog, set_timeout, status_message
-from sublime_plugin import EventListener
+    load_settings, message_dialog, packages_path, set_timeout, status_message
+from sublime_plugin import EventListener, TextCommand
 
 from powerlime.help.base import SelectionCommand
-from powerlime.util import ExternalPythonCaller, PythonSpecificCommand, \
-    async_worker
+from powerlime.util import ExternalCallError, ExternalPythonCaller, \
+    PythonSpecificCommand, WorkerThread, async_worker
 
 
 def is_python_source_file(file_name):
     return file_name.endswith('.py') or file_name.endswith('.pyw')
 
 
+# Index cache layout: header, NUL-separated UTF-8 symbols and one byte per
+# symbol with its type number. The header holds modification time, size and
+# MD5 digest of the HTML index the cache was built from.
+INDEX_CACHE_MAGIC = 'PLPYIDX1'
+INDEX_CACHE_HEADER = struct.Struct('<8sdQ16sII')
+
+
+def file_digest(path):
+    digest = md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), ''):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def read_index_cache(path, type_codes):
+    ''' Returns (stamp, index) read from index cache at path. '''
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < INDEX_CACHE_HEADER.size:
+        raise ValueError('Truncated index cache')
+    magic, mtime, size, digest, count, blob_size = \
+        INDEX_CACHE_HEADER.unpack_from(data)
+    blob_end = INDEX_CACHE_HEADER.size + blob_size
+    if magic != INDEX_CACHE_MAGIC or len(data) != blob_end + count:
+        raise ValueError('Invalid index cache')
+
+    symbols = data[INDEX_CACHE_HEADER.size:blob_end].decode('utf-8')
+    symbols = symbols.split(u'\0') if count else []
+    if len(symbols) != count:
+        raise ValueError('Invalid index cache')
+    types = [type_codes[ord(code)] for code in data[blob_end:]]
+    return (mtime, size, digest), dict(izip(symbols, types))
+
+
+def write_index_cache(path, type_codes, index, stamp):
+    codes = dict((typ, chr(i)) for i, typ in enumerate(type_codes))
+    symbols = index.keys()
+    blob = u'\0'.join(symbols).encode('utf-8')
+    types = ''.join(codes[index[sym]] for sym in symbols)
+    with open(path, 'wb') as out:
+        out.write(INDEX_CACHE_HEADER.pack(INDEX_CACHE_MAGIC, stamp[0],
+                                          stamp[1], stamp[2], len(symbols),
+                                          len(blob)))
+        out.write(blob)
+        out.write(types)
+
+
+# Doc store layout, as written by external/pydocrender.py: header, sorted
+# NUL-separated UTF-8 symbols, count + 1 offsets into the data section and
+# zlib-compressed documentation texts.
+DOC_STORE_MAGIC = 'PLPYDOC1'
+DOC_STORE_HEADER = struct.Struct('<8sII')
+
+
+class DocStore(object):
+    ''' Read-only access to documentation rendered in advance '''
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, count, names_size = DOC_STORE_HEADER.unpack_from(self.data)
+            if magic != DOC_STORE_MAGIC:
+                raise ValueError('Invalid doc store')
+            names_end = DOC_STORE_HEADER.size + names_size
+            names = self.data[DOC_STORE_HEADER.size:names_end].decode('utf-8')
+            names = names.split(u'\0') if count else []
+            self.offsets = struct.unpack_from('<{0}I'.format(count + 1),
+                                              self.data, names_end)
+            self.data_start = names_end + 4 * (count + 1)
+            if len(names) != count or \
+                    self.data_start + self.offsets[-1] != len(self.data):
+                raise ValueError('Invalid doc store')
+        except (struct.error, ValueError):
+            self.data.close()
+            raise ValueError('Invalid doc store')
+        self.positions = dict((name, i) for i, name in enumerate(names))
+
+    def __contains__(self, sym):
+        return sym in self.positions
+
+    def get(self, sym):
+        i = self.positions.get(sym)
+        if i is None:
+            return None
+        return zlib.decompress(self.data[self.data_start + self.offsets[i]:
+                                         self.data_start + self.offsets[i + 1]])
+
+    def close(self):
+        self.data.close()
+
+
+# Positions starting a component of a dotted name or a word inside it.
+BOUNDARY_RE = re.compile(r'(?:^|(?<=[._]))[^._]|(?<=[a-z])[A-Z]')
+
+
+class SymbolIndex(object):
+    ''' Python help index, searchable by components of dotted names '''
+
+    # Query characters with positions caught for fuzzy scoring (Python regexes
+    # support up to 100 groups).
+    MAX_FUZZY_GROUPS = 50
+
+    # Score added to fuzzy matches containing the whole query as a substring.
+    SUBSTRING_BONUS = 1000
+
+    def __init__(self, types):
+        self.types = types
+
+        # All the symbols, in the order they're presented to the user.
+        self.symbols = sorted(types,
+                              key=lambda sym: (sym.count('.'), sym, types[sym]))
+
+        # Maps each name component to ascending positions in self.symbols, so
+        # results come out already sorted.
+        self.by_component = {}
+        for i, sym in enumerate(self.symbols):
+            for component in set(sym.split('.')):
+                self.by_component.setdefault(component, []).append(i)
+
+        # Sorted components, for prefix lookups.
+        self.components = sorted(self.by_component)
+
+        # Lowercased symbols and, for each character, a bit set of symbols
+        # containing it, for fast filtering of fuzzy match candidates.
+        self.keys = [sym.lower() for sym in self.symbols]
+        char_sets = {}
+        for i, key in enumerate(self.keys):
+            for char in set(key):
+                char_set = char_sets.get(char)
+                if char_set is None:
+                    char_set = char_sets[char] = bytearray('0' * len(self.keys))
+                char_set[i] = '1'
+        self.char_sets = dict((char, long(str(char_set)[::-1], 2))
+                              for char, char_set in char_sets.iteritems())
+
+        # Masks of positions starting a component or a word inside it.
+        self.boundaries = [self.get_boundaries(sym) for sym in self.symbols]
+
+    @staticmethod
+    def get_boundaries(sym):
+        mask = bytearray(len(sym))
+        for match in BOUNDARY_RE.finditer(sym):
+            mask[match.start()] = 1
+        return str(mask)
+
+    def find(self, component):
+        return [self.symbols[i] for i in self.by_component.get(component, ())]
+
+    def find_prefix(self, prefix):
+        positions = set()
+        i = bisect_left(self.components, prefix)
+        while i < len(self.components) and \
+                self.components[i].startswith(prefix):
+            positions.update(self.by_component[self.components[i]])
+            i += 1
+        return [self.symbols[i] for i in sorted(positions)]
+
+    def find_fuzzy(self, text, limit):
+        ''' Returns up to limit best symbols containing characters of text as
+        a subsequence. '''
+        if not text:
+            return self.symbols[:limit]
+
+        query = text.lower()
+        candidates = -1
+        for char in set(query):
+            candidates &= self.char_sets.get(char, 0)
+        if not candidates:
+            return []
+
+        # Groups catch positions of the query characters, for scoring.
+        pattern = re.compile(u''.join(
+            (u'[^{0}]*({0})' if n < self.MAX_FUZZY_GROUPS else u'[^{0}]*{0}')
+            .format(re.escape(char)) for n, char in enumerate(query)))
+
+        # Walk bits of the candidate set, least significant first.
+        bits = bin(candidates)[:1:-1]
+        scores = []
+        i = bits.find('1')
+        while i != -1:
+            key = self.keys[i]
+            pos = key.find(query)
+            if pos != -1:
+                positions = xrange(pos, pos + len(query))
+                scores.append((self.SUBSTRING_BONUS +
+                               self.fuzzy_score(i, positions), -i))
+            else:
+                match = pattern.match(key)
+                if match is not None:
+                    scores.append((self.fuzzy_score(i, (
+                        match.start(group)
+                        for group in xrange(1, pattern.groups + 1))), -i))
+            i = bits.find('1', i + 1)
+
+        return [self.symbols[-i] for _, i in nlargest(limit, scores)]
+
+    def fuzzy_score(self, i, positions):
+        ''' Scores match of the i-th symbol, favouring query characters
+        starting words and following each other, and short symbols. '''
+        boundaries = self.boundaries[i]
+        score = -len(boundaries)
+        prev = 0
+        for pos in positions:
+            if boundaries[pos] == '\1':
+                score += 20
+            if pos == prev:
+                score += 10
+            prev = pos + 1
+        return score
+
+
 class PyDocHelpCommand(SelectionCommand, PythonSpecificCommand):
     ''' Display internal Python help index '''
 
@@ -33,7 +253,25 @@ class PyDocHelpCommand(SelectionCommand, PythonSpecificCommand):
         'fun': ('function', r'\(in module .*\)$'),
     }
 
+    # Type codes, in the order of their numbers in the index cache.
+    TYPE_CODES = sorted(TYPES)
+
     parseindex = ExternalPythonCaller('parseindex')
+    pydoc = ExternalPythonCaller('pydocrender', persistent=True)
+
+    index = None
+    index_lock = Lock()
+    # Set while the index is loaded in the background, with callbacks to run
+    # on the UI thread once it's done.
+    index_loading = False
+    index_callbacks = []
+
+    store = None
+    store_lock = Lock()
+    # Set while the store is being rebuilt, the old file isn't loaded then.
+    store_building = False
+
+    prefetch_generation = 0
 
     def handle(self, text):
         if text.startswith('?'):
@@ -44,90 +282,178 @@ class PyDocHelpCommand(SelectionCommand, PythonSpecificCommand):
         self.symbol_format = self.view.settings().get('pydoc_symbol_format',
             '{0} - {1}')
 
-        index = [
-            (sym, typ)
-            for sym, typ
-            in self.get_index().iteritems()
-            if text in sym.split('.')
-        ]
-        if not index:
+        index = self.get_index(partial(self.handle, text))
+        if index is None:
+            return
+        max_items = self.view.settings().get('pydoc_max_items', 200)
+        symbols = index.find(text) or index.find_prefix(text)
+        if not symbols:
             if self.show_doc(text):
                 return
-            index = self.get_index().items()
-        elif len(index) == 1 and index[0][0] == text and \
-                self.show_doc(index[0][0]):
+            symbols = index.find_fuzzy(text, max_items)
+            if not symbols:
+                status_message('Not found: ' + text)
+                return
+        elif len(symbols) == 1 and symbols[0] == text and \
+                self.show_doc(text):
             return
 
+        del symbols[max_items:]
+
         def on_select(i):
-            if i == len(index):
+            if i == len(symbols):
                 self.query_input('? ' + text, select=(2, None))
             elif i != -1:
-                self.show_doc(index[i][0])
+                self.show_doc(symbols[i])
 
-        def sym_key((sym, typ)):
-            return sym.count('.'), sym, typ
-
-        items = []
-        index.sort(key=sym_key)
-        for sym, typ in index:
-            items.append(self.get_symbol_item(sym, typ))
+        items = [self.get_symbol_item(sym, index.types[sym])
+                 for sym in symbols]
         items.append('<other...>')
         self.view.window().show_quick_panel(items, on_select,
             MONOSPACE_FONT)
+        self.prefetch_docs(symbols[:self.view.settings().get('pydoc_prefetch',
+                                                             10)])
+
+    def get_index(self, retry):
+        ''' Returns the index, or None if it's not loaded yet, calling retry
+        once it is. Parsing the HTML index takes a while, so it's never
+        loaded on the UI thread. '''
+        if PyDocHelpCommand.index is None:
+            status_message('Python help index is loading...')
+            self.load_index_async(self.get_index_paths(self.view.settings()),
+                                  retry)
+        return PyDocHelpCommand.index
+
+    @staticmethod
+    def get_index_paths(settings):
+        cache_path = settings.get('pydoc_parsed_index')
+        if cache_path is None:
+            cache_path = os.path.join(packages_path(), 'User',
+                                      'PowerLime.pydoc-index')
+        html_path = settings.get('pydoc_html_index',
+            '/usr/share/doc/python2.7/html/genindex-all.html')
+        return cache_path, html_path
+
+    @staticmethod
+    def get_store_path(settings):
+        path = settings.get('pydoc_doc_store')
+        if path is None:
+            path = os.path.join(packages_path(), 'User',
+                                'PowerLime.pydoc-store')
+        return path
+
+    @classmethod
+    def load_store(cls, path):
+        with cls.store_lock:
+            if cls.store is None and not cls.store_building:
+                try:
+                    cls.store = DocStore(path)
+                except IOError:
+                    pass
+                except ValueError as e:
+                    print 'Cannot load {0}: {1}'.format(path, e)
+            return cls.store
+
+    @classmethod
+    def close_store(cls, building=False):
+        ''' Unloads the store, keeping it unloaded while building is set. '''
+        with cls.store_lock:
+            cls.store_building = building
+            if cls.store is not None:
+                cls.store.close()
+                cls.store = None
+
+    @classmethod
+    def preload_index(cls):
+        ''' Loads the index in the background, so it's ready before the first
+        query. '''
+        settings = load_settings('Preferences.sublime-settings')
+        async_worker.execute(cls.load_store, cls.get_store_path(settings))
+        cls.load_index_async(cls.get_index_paths(settings))
+
+    @classmethod
+    def load_index_async(cls, paths, callback=None):
+        ''' Loads the index in the background, unless it's already being
+        loaded, and calls callback on the UI thread once it's loaded. '''
+        if callback is not None:
+            cls.index_callbacks.append(callback)
+        if cls.index_loading:
+            return
+        cls.index_loading = True
 
-    def get_index(self):
+        def load():
+            try:
+                cls.load_index(*paths)
+            except (IOError, OSError, ExternalCallError) as e:
+                set_timeout(partial(done, e), 0)
+            else:
+                set_timeout(partial(done, None), 0)
+
+        def done(error):
+            cls.index_loading = False
+            callbacks = cls.index_callbacks
+            cls.index_callbacks = []
+            if error is not None:
+                message = 'Cannot load Python help index: {0}'.format(error)
+                if callbacks:
+                    error_message(message)
+                else:
+                    print message
+                return
+            for callback in callbacks:
+                callback()
+
+        async_worker.execute(load)
+
+    @classmethod
+    def load_index(cls, cache_path, html_path):
+        with cls.index_lock:
+            if cls.index is None:
+                cls.index = SymbolIndex(cls.read_index(cache_path, html_path))
+            return cls.index
+
+    @classmethod
+    def read_index(cls, cache_path, html_path):
+        ''' Returns index read from the cache, rebuilding it if it's outdated
+        with respect to the HTML index. '''
         try:
-            return PyDocHelpCommand.index
-        except AttributeError:
-            pass
+            html_stat = os.stat(html_path)
+        except OSError:
+            html_stat = None
 
-        settings = self.view.settings()
+        try:
+            stamp, index = read_index_cache(cache_path, cls.TYPE_CODES)
+        except (IOError, ValueError):
+            pass
+        else:
+            if html_stat is None or \
+                    stamp[:2] == (html_stat.st_mtime, html_stat.st_size):
+                print 'Loaded {0}'.format(cache_path)
+                return index
 
-        path = settings.get('pydoc_parsed_index')
-        if path is not None:
-            try:
-                index = self.load_index(path)
-            except IOError:
-                pass
-            else:
-                print 'Loaded {0}'.format(path)
-                PyDocHelpCommand.index = index
+            # Only the modification time has changed, update the stamp.
+            digest = file_digest(html_path)
+            if digest == stamp[2]:
+                write_index_cache(cache_path, cls.TYPE_CODES, index,
+                    (html_stat.st_mtime, html_stat.st_size, digest))
+                print 'Loaded {0}'.format(cache_path)
                 return index
 
-        html_path = settings.get('pydoc_html_index',
-            '/usr/share/doc/python2.7/html/genindex-all.html')
-        index = self.gen_index(html_path)
+        if html_stat is None:
+            raise IOError('{0} not found'.format(html_path))
+        digest = file_digest(html_path)
+        index = cls.gen_index(html_path)
         print 'Parsed {0}'.format(html_path)
-        PyDocHelpCommand.index = index
 
-        with open(path, 'w') as out:
-            for sym, typ in index.iteritems():
-                out.write('{0}:{1}\n'.format(sym, typ))
-        print 'Written {0}'.format(path)
-
-        return index
-
-    def gen_index(self, html_path):
-        MOD_PREFIX = 'module-'
-        index = {}
-        for href, name in self.parseindex.main(html_path):
-            sym = href.split('#', 1)[1]
-            if re.match(r'index-\d+$', sym):
-                continue
-            for typ, (_, regex) in self.TYPES.iteritems():
-                if re.search(regex, name):
-                    if typ == 'mod' and sym.startswith(MOD_PREFIX):
-                        sym = sym[len(MOD_PREFIX):]
-                    index[sym] = typ
+        write_index_cache(cache_path, cls.TYPE_CODES, index,
+                          (html_stat.st_mtime, html_stat.st_size, digest))
+        print 'Written {0}'.format(cache_path)
         return index
 
-    def load_index(self, file_name):
-        index = {}
-        for line in open(file_name):
-            sym, typ = line.rstrip('\n').split(':', 1)
-            assert sym not in index
-            index[sym] = typ
-        return index
+    @classmethod
+    def gen_index(cls, html_path):
+        types = [(typ, regex) for typ, (_, regex) in cls.TYPES.iteritems()]
+        return dict(cls.parseindex.parse.iter(html_path, types))
 
     def get_symbol_item(self, sym, typ):
         if self.symbol_format is None:
@@ -138,11 +464,12 @@ class PyDocHelpCommand(SelectionCommand, PythonSpecificCommand):
     # Rendering help
 
     def show_doc(self, sym):
-        doc = self.get_doc(sym)
-        if doc is None:
+        try:
+            doc = self.get_doc(sym)
+        except ExternalCallError:
             error_message('Internal help system error')
             return False
-        if doc.startswith('no Python documentation found for '):
+        if doc is None:
             return False
 
         win = active_window()
@@ -169,11 +496,80 @@ class PyDocHelpCommand(SelectionCommand, PythonSpecificCommand):
         return True
 
     def get_doc(self, sym):
-        try:
-            proc = Popen(['pydoc', sym], stdout=PIPE)
-        except OSError:
-            return None
-        output = proc.stdout.read()
-        if proc.wait() != 0:
-            return None
-        return output
+        store = self.load_store(self.get_store_path(self.view.settings()))
+        if store is not None and sym in store:
+            return store.get(sym)
+        return self.pydoc.render(sym)
+
+    def prefetch_docs(self, syms):
+        ''' Renders documentation in the background, so that showing it later
+        is a cache hit. Each job renders a single symbol and queues the next
+        one, so interactive lookups never wait for more than one render. '''
+        store = self.store
+        if store is not None:
+            syms = [sym for sym in syms if sym not in store]
+        if not syms:
+            return
+
+        # A new query cancels prefetching for the previous one.
+        PyDocHelpCommand.prefetch_generation += 1
+        generation = PyDocHelpCommand.prefetch_generation
+
+        def prefetch(i):
+            if generation != PyDocHelpCommand.prefetch_generation:
+                return
+            try:
+                self.pydoc.prefetch([syms[i]])
+            except ExternalCallError as e:
+                print 'Python help prefetch failed: {0}'.format(e)
+                return
+            if i + 1 < len(syms):
+                async_worker.execute(prefetch, i + 1)
+
+        async_worker.execute(prefetch, 0)
+
+
+class PyDocBuildStoreCommand(TextCommand):
+    ''' Render documentation of all the indexed symbols into the doc store '''
+
+    # Spawns a separate process, so the imports don't end up in the worker
+    # used for interactive help. Progress is reported as it comes.
+    builder = ExternalPythonCaller('pydocrender', stream_batch=1)
+
+    # Building takes minutes, so it has its own thread rather than holding up
+    # the jobs of the shared worker.
+    build_worker = WorkerThread()
+
+    def run(self, edit):
+        settings = self.view.settings()
+        paths = PyDocHelpCommand.get_index_paths(settings)
+        store_path = PyDocHelpCommand.get_store_path(settings)
+
+        def build():
+            try:
+                index = PyDocHelpCommand.load_index(*paths)
+                for progress in self.builder.build_store.iter(store_path,
+                                                              index.symbols):
+                    if isinstance(progress, tuple):
+                        set_timeout(partial(status_message,
+                            'Building Python help store: {0}/{1}'.format(
+                                *progress)), 0)
+                    else:
+                        count = progress
+            except (IOError, OSError, ExternalCallError) as e:
+                set_timeout(partial(error_message,
+                    'Cannot build Python help store: {0}'.format(e)), 0)
+            else:
+                set_timeout(partial(status_message,
+                    'Python help store: {0} entries'.format(count)), 0)
+            finally:
+                PyDocHelpCommand.close_store()
+                PyDocHelpCommand.load_store(store_path)
+
+        # The old store must not stay mapped while it's replaced.
+        PyDocHelpCommand.close_store(building=True)
+        status_message('Building Python help store...')
+        self.build_worker.execute(build)
+
+
+set_timeout(PyDocHelpCommand.preload_index, 0)
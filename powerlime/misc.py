@@ -3,11 +3,15 @@ import os.path
 import re
 
 from collections import deque
-from itertools import chain
+from functools import partial
 
-from sublime import LITERAL, Region, TRANSIENT, set_clipboard, set_timeout, \
-    windows
-from sublime_plugin import EventListener, TextCommand
+from sublime import Region, TRANSIENT, set_clipboard, set_timeout, \
+    status_message, windows
+from sublime_plugin import EventListener, TextCommand, WindowCommand
+
+from powerlime.fileindex import FileIndex, get_search_paths
+from powerlime.statcache import stat_cache
+from powerlime.util import async_worker
 
 
 class CopyCurrentPathCommand(TextCommand):
@@ -16,15 +20,18 @@ class CopyCurrentPathCommand(TextCommand):
     def run(self, edit, relative=True):
         path = self.view.file_name()
         if relative:
-            path = os.path.realpath(path)
+            path = stat_cache.realpath(path)
             for folder in self.view.window().folders():
-                folder = os.path.realpath(folder)
+                folder = stat_cache.realpath(folder)
                 if path.startswith(folder + os.sep):
                     path = path[len(folder) + 1:]
                     break
         set_clipboard(path)
 
 
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
 class FindAllVisible(TextCommand):
     def run(self, edit, compatible=True):
         if compatible:
@@ -49,39 +56,69 @@ class FindAllVisible(TextCommand):
         visible_region = view.visible_region()
         sel = view.sel()
         user_sel = list(sel)
-        sel.clear()
+
+        # Words under empty selections are looked up among the words of the
+        # visible text, other selections go into a single pattern, longest
+        # first, so the text is scanned once for each kind.
+        texts = []
+        words = set()
+        patterns = {}
         for single_sel in user_sel:
             if single_sel.empty():
-                regions = self.find_iter(
-                        visible_region,
-                        r'\b{0}\b'.format(re.escape(view.substr(view.word(
-                                single_sel)))),
-                        0)
+                text = view.substr(view.word(single_sel))
+                match = WORD_RE.match(text)
+                if match is not None and match.end() == len(text):
+                    words.add(text)
+                elif text.strip():
+                    patterns[r'\b{0}\b'.format(re.escape(text))] = len(text)
             else:
-                regions = self.find_iter(visible_region,
-                                         view.substr(single_sel),
-                                         LITERAL)
-
-            empty = True
-            for region in regions:
-                sel.add(region)
-                empty = False
-            if empty:
-                sel.add(single_sel)
+                text = view.substr(single_sel)
+                patterns[re.escape(text)] = len(text)
+            texts.append(text)
+
+        # Whole lines are scanned, so that word boundaries at the edges of the
+        # visible region are right.
+        begin = visible_region.begin()
+        end = visible_region.end()
+        scan_begin = view.line(begin).begin()
+        text = view.substr(Region(scan_begin, view.line(end).end()))
+        pos = begin - scan_begin
+        end_pos = end - scan_begin
 
-    def find_iter(self, region, pattern, flags):
-        pos = region.begin()
-        while True:
-            match = self.view.find(pattern, pos, flags)
-            if match is None or match.begin() >= region.end():
-                break
-            yield match
-            pos = match.end()
+        sel.clear()
+        found = set()
+        if words:
+            # Words cut by the start of the visible region don't count.
+            for match in WORD_RE.finditer(text):
+                if match.start() >= end_pos:
+                    break
+                if match.start() >= pos and match.group() in words:
+                    sel.add(Region(scan_begin + match.start(),
+                                   scan_begin + match.end()))
+                    found.add(match.group())
+        if patterns:
+            regex = re.compile(u'|'.join(sorted(
+                patterns, key=lambda pattern: (-patterns[pattern], pattern))),
+                re.UNICODE)
+            for match in regex.finditer(text, pos):
+                if match.start() >= end_pos:
+                    break
+                sel.add(Region(scan_begin + match.start(),
+                               scan_begin + match.end()))
+                found.add(match.group())
+
+        # Selections with nothing found stay as they were.
+        for single_sel, text in zip(user_sel, texts):
+            if text not in found:
+                sel.add(single_sel)
 
 
 class OpenFileAtCursorCommand(TextCommand):
     ''' Opens a file under the cursor '''
 
+    # Maximum number of similarly named files offered when nothing matches.
+    MAX_SUGGESTIONS = 10
+
     def run(self, edit, transient=False):
         view = self.view
         if transient:
@@ -89,6 +126,7 @@ class OpenFileAtCursorCommand(TextCommand):
         else:
             flags = 0
 
+        missing = []
         for sel in view.sel():
             if sel.empty():
                 line = view.line(sel.a)
@@ -99,24 +137,80 @@ class OpenFileAtCursorCommand(TextCommand):
                 file_names = [view.substr(sel)]
 
             window = view.window()
-            search_paths = list(chain.from_iterable(
-                window.folders() if dir_name is None else [dir_name]
-                for dir_name in
-                view.settings().get('open_search_paths', ['.', None])
-            ))
-            for file_name in file_names:
-                if not os.path.isabs(file_name):
-                    for dir_name in search_paths:
-                        full_name = os.path.join(dir_name, file_name)
-                        if os.path.isfile(full_name):
-                            window.open_file(full_name, flags)
-                            return
-                    else:
-                        continue
-                else:
-                    full_name = file_name
+            full_name = self.find_file(file_names)
+            if full_name is not None:
                 window.open_file(full_name, flags)
                 return
+            missing.extend(name for name in file_names if name.strip())
+
+        self.suggest_files(missing, flags)
+
+    def find_file(self, file_names):
+        ''' Looks file names up in the window's file index, checking the disk
+        for files missing from it, then falls back to indexed files with
+        paths ending with a name. Only probes search paths while the index
+        is being built. '''
+        search_paths = get_search_paths(self.view)
+        table = FileIndex.get_for(self.view).table
+        if table is None:
+            return self.find_on_disk(file_names, search_paths)
+
+        dirs = list(search_paths)
+        if self.view.file_name() is not None:
+            dirs.insert(0, os.path.dirname(self.view.file_name()))
+        for file_name in file_names:
+            if os.path.isabs(file_name):
+                return file_name
+            full_name = table.find(file_name, dirs)
+            if full_name is not None:
+                return full_name
+        for file_name in file_names:
+            full_name = table.find_by_suffix(file_name)
+            if full_name is not None:
+                return full_name
+        return None
+
+    def suggest_files(self, file_names, flags):
+        ''' Lets the user pick one of indexed files with names similar to
+        file_names. They are looked up in the background, as all the indexed
+        names are compared. '''
+        table = FileIndex.get_for(self.view).table
+        if table is None or not file_names:
+            status_message('File not found')
+            return
+        window = self.view.window()
+
+        def search():
+            paths = []
+            for file_name in file_names:
+                for path in table.find_fuzzy(file_name, self.MAX_SUGGESTIONS):
+                    if path not in paths:
+                        paths.append(path)
+            set_timeout(partial(show, paths[:self.MAX_SUGGESTIONS]), 0)
+
+        def show(paths):
+            if not paths:
+                status_message('File not found')
+                return
+
+            def on_select(index):
+                if index != -1:
+                    window.open_file(paths[index], flags)
+
+            window.show_quick_panel(paths, on_select)
+
+        status_message('File not found, looking for similar names...')
+        async_worker.execute(search)
+
+    def find_on_disk(self, file_names, search_paths):
+        for file_name in file_names:
+            if os.path.isabs(file_name):
+                return file_name
+            for dir_name in search_paths:
+                full_name = os.path.join(dir_name, file_name)
+                if stat_cache.isfile(full_name):
+                    return full_name
+        return None
 
     def get_file_names(self, line, pos):
         def find_range(begin, end):
@@ -155,16 +249,61 @@ class OpenAncestorFileCommand(TextCommand):
             path = head
         components.reverse()
 
+        # Files missing from the index are checked on disk, as it may be out
+        # of date.
+        table = FileIndex.get_for(self.view).table
         while components:
             components[-1] = name
             file_name = os.path.join(*components)
-            if os.path.isfile(file_name):
+            found = table is not None and \
+                table.covers(os.path.dirname(file_name)) and \
+                table.get_id(file_name) is not None
+            if not found:
+                found = stat_cache.isfile(file_name)
+            if found:
                 self.view.window().open_file(file_name, TRANSIENT if transient
                     else 0)
                 break
             components.pop()
 
 
+class ShowStatCacheStatsCommand(WindowCommand):
+    ''' Reports how well the file system metadata cache works. '''
+
+    def run(self):
+        report = 'Stat cache: ' + stat_cache.get_report()
+        print report
+        status_message(report)
+
+
+class OpenIncludedFileCommand(TextCommand):
+    ''' Lets the user pick one of the files included by the current one, or
+    including it, to open. '''
+
+    def run(self, edit, includers=False):
+        view = self.view
+        table = FileIndex.get_for(view).table
+        if table is None:
+            status_message('File index is being built, try again shortly')
+            return
+
+        paths = table.get_related(view.file_name(), includers)
+        if not paths:
+            status_message('No {0} files found'.format(
+                'including' if includers else 'included'))
+            return
+
+        def on_done(i):
+            if i != -1:
+                view.window().open_file(paths[i])
+
+        view.window().show_quick_panel(
+            [[os.path.basename(path), path] for path in paths], on_done)
+
+    def is_enabled(self, includers=False):
+        return self.view.file_name() is not None
+
+
 class FoldBySelectorCommand(TextCommand):
     def run(self, edit, selector, unfold=False):
         view = self.view
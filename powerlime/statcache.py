@@ -0,0 +1,142 @@
+''' Short-lived cache of file system metadata, shared by the commands probing
+the same paths over and over. Doesn't depend on Sublime, so external scripts
+can use it too. '''
+import os
+import os.path
+
+from stat import S_ISDIR, S_ISREG
+from time import time
+
+# Seconds cached results stay valid.
+TTL = 2.0
+
+# Expired entries are dropped when a table grows that large.
+MAX_ENTRIES = 10000
+
+
+class StatCache(object):
+    ''' Caches stat, listdir and realpath results for ttl seconds.
+
+    A path missing from the cached listing of its directory is known not to
+    exist without calling stat, so probing many names in a few directories
+    costs about one listdir per directory. Counters tell how many lookups were
+    answered from the cache and how many system calls that saved.
+
+    Tables are only read and replaced entry by entry, so the cache can be used
+    from several threads without locking, counters may be slightly off then.
+    '''
+
+    def __init__(self, ttl=TTL):
+        self.ttl = ttl
+        # Paths to (time, stat result or None if missing).
+        self.stats = {}
+        # Directories to (time, sets of names and of lowercase names, or None
+        # if unreadable).
+        self.listings = {}
+        # Paths to (time, real path).
+        self.realpaths = {}
+        self.hits = 0
+        self.misses = 0
+        self.saved_calls = 0
+
+    def get_fresh(self, table, key, now):
+        entry = table.get(key)
+        if entry is not None and now - entry[0] < self.ttl:
+            return entry
+        return None
+
+    def store(self, table, key, value, now):
+        if len(table) >= MAX_ENTRIES:
+            for old_key, entry in table.items():
+                if now - entry[0] >= self.ttl:
+                    del table[old_key]
+            if len(table) >= MAX_ENTRIES:
+                table.clear()
+        table[key] = (now, value)
+
+    def get_listing(self, path):
+        now = time()
+        entry = self.get_fresh(self.listings, path, now)
+        if entry is not None:
+            self.hits += 1
+            self.saved_calls += 1
+            return entry[1]
+
+        self.misses += 1
+        try:
+            names = frozenset(os.listdir(path))
+        except OSError:
+            listing = None
+        else:
+            listing = (names, frozenset(name.lower() for name in names))
+        self.store(self.listings, path, listing, now)
+        return listing
+
+    def listdir(self, path):
+        ''' Returns a set of names in directory path, or None if it can't be
+        listed. '''
+        listing = self.get_listing(path)
+        return listing[0] if listing is not None else None
+
+    def stat(self, path):
+        ''' Returns os.stat result for path, or None if it doesn't exist. '''
+        now = time()
+        entry = self.get_fresh(self.stats, path, now)
+        if entry is not None:
+            self.hits += 1
+            self.saved_calls += 1
+            return entry[1]
+
+        # Negative results come from the directory listing, which answers
+        # the following probes in the same directory too. Names differing
+        # only in case may still exist on case-insensitive file systems, so
+        # they are left to stat.
+        dir_name, name = os.path.split(path)
+        if name:
+            listing = self.get_listing(dir_name or os.curdir)
+            if listing is not None and name.lower() not in listing[1]:
+                self.store(self.stats, path, None, now)
+                return None
+
+        self.misses += 1
+        try:
+            result = os.stat(path)
+        except OSError:
+            result = None
+        self.store(self.stats, path, result, now)
+        return result
+
+    def isfile(self, path):
+        result = self.stat(path)
+        return result is not None and S_ISREG(result.st_mode)
+
+    def isdir(self, path):
+        result = self.stat(path)
+        return result is not None and S_ISDIR(result.st_mode)
+
+    def realpath(self, path):
+        now = time()
+        entry = self.get_fresh(self.realpaths, path, now)
+        if entry is not None:
+            self.hits += 1
+            # Resolving links takes a lstat for each path component.
+            self.saved_calls += len(entry[1].split(os.sep))
+            return entry[1]
+
+        self.misses += 1
+        result = os.path.realpath(path)
+        self.store(self.realpaths, path, result, now)
+        return result
+
+    def forget(self, path):
+        ''' Drops cached data about path, which has just been changed. '''
+        self.stats.pop(path, None)
+        self.realpaths.pop(path, None)
+        self.listings.pop(os.path.dirname(path) or os.curdir, None)
+
+    def get_report(self):
+        return '{0} hits, {1} misses, {2} system calls saved'.format(
+            self.hits, self.misses, self.saved_calls)
+
+
+stat_cache = StatCache()
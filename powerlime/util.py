@@ -5,11 +5,14 @@ import os.path
 from Queue import Empty, Queue
 from functools import partial
 from subprocess import PIPE, Popen
-from threading import Lock, Thread
+from threading import Lock, RLock, Thread
+from time import time
 
-from sublime import View
+from sublime import Region, View, set_timeout
 from sublime_plugin import TextCommand
 
+from powerlime.format.diff import line_hunks
+
 PICKLE_PROTOCOL = 2
 
 
@@ -23,23 +26,59 @@ class FunctionProxy(object):
         self.fname = fname
 
     def __call__(self, *args, **kwargs):
-        proc = self.caller.get_process()
-        try:
-            pickle.dump((self.fname, args, kwargs), proc.stdin,
-                        PICKLE_PROTOCOL)
-            return pickle.load(proc.stdout)
-        except (IOError, EOFError, pickle.UnpicklingError):
-            self.caller.reset()
-            raise ExternalCallError(proc.stderr.read())
+        with self.caller.lock:
+            proc = self.caller.get_process()
+            try:
+                pickle.dump((self.fname, args, kwargs), proc.stdin,
+                            PICKLE_PROTOCOL)
+                return pickle.load(proc.stdout)
+            except (IOError, EOFError, pickle.UnpicklingError):
+                self.caller.reset()
+                raise ExternalCallError(proc.stderr.read())
+
+    def iter(self, *args, **kwargs):
+        ''' Calls a function returning an iterable, yielding the results as
+        soon as the external process sends them. '''
+        with self.caller.lock:
+            proc = self.caller.get_process()
+            finished = False
+            try:
+                pickle.dump((self.fname, args, kwargs,
+                             self.caller.STREAM_BATCH),
+                            proc.stdin, PICKLE_PROTOCOL)
+                while True:
+                    batch = pickle.load(proc.stdout)
+                    if not batch:
+                        finished = True
+                        break
+                    for item in batch:
+                        yield item
+            except (IOError, EOFError, pickle.UnpicklingError):
+                finished = True
+                self.caller.reset()
+                raise ExternalCallError(proc.stderr.read())
+            finally:
+                # Drain the stream if the caller stopped early, so the process
+                # is ready for the next call.
+                while not finished:
+                    try:
+                        finished = not pickle.load(proc.stdout)
+                    except (IOError, EOFError, pickle.UnpicklingError):
+                        self.caller.reset()
+                        break
 
 
 class ExternalPythonCaller(object):
     SCRIPTS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..',
         'external'))
 
+    # Maximum number of results sent at once by FunctionProxy.iter.
+    STREAM_BATCH = 64
+
     proc = None
 
-    def __init__(self, module, python='python'):
+    def __init__(self, module, python='python', persistent=False,
+                 stream_batch=None):
         self.popen_args = {
             'args': [
                 python,
@@ -51,6 +90,14 @@ class ExternalPythonCaller(object):
             'stdout': PIPE,
             'stderr': PIPE
         }
+        self.lock = RLock()
+        if stream_batch is not None:
+            self.STREAM_BATCH = stream_batch
+
+        # Persistent callers keep a single process for all the calls.
+        self.persistent = persistent
+        if persistent:
+            self.proc = True
 
     def __getattr__(self, name):
         if name.startswith('_'):
@@ -58,11 +105,14 @@ class ExternalPythonCaller(object):
         return FunctionProxy(self, name)
 
     def __enter__(self):
-        self.popen_args = self.popen_args
-        self.proc = True
+        if not self.persistent:
+            self.proc = True
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
+        if self.persistent:
+            return False
+
         if self.proc is True:
             self.proc = None
             return False
@@ -82,6 +132,12 @@ class ExternalPythonCaller(object):
 
     def reset(self):
         if self.proc is not None and self.proc is not True:
+            # Persistent workers only exit once told to, and the stream may
+            # be broken, so stop the process before waiting for it.
+            try:
+                self.proc.kill()
+            except OSError:
+                pass
             self.proc.wait()
             self.proc = True
 
@@ -116,6 +172,74 @@ class WorkerThread(object):
 async_worker = WorkerThread()
 
 
+class PanelSearch(object):
+    ''' Base of searches showing results arriving in the background in the
+    quick panel, re-showing it as more of them come.
+
+    Subclasses implement poll_results, called on the UI thread every
+    POLL_INTERVAL ms until it returns False.
+    '''
+
+    POLL_INTERVAL = 20
+
+    def __init__(self, window):
+        self.window = window
+        self.panel_open = False
+        self.generation = 0
+
+    def poll(self):
+        if self.poll_results():
+            set_timeout(self.poll, self.POLL_INTERVAL)
+
+    def poll_results(self):
+        raise NotImplementedError
+
+    def show_panel(self, items, on_select):
+        ''' Shows items in the quick panel, replacing the previous one.
+        on_select is called with the chosen index, or -1, unless another panel
+        was shown meanwhile. '''
+        # Re-showing the panel cancels the previous one, so ignore callbacks
+        # from outdated panels.
+        self.generation += 1
+        generation = self.generation
+
+        def on_done(index):
+            if generation == self.generation:
+                self.panel_open = False
+                on_select(index)
+
+        self.panel_open = True
+        self.window.show_quick_panel(items, on_done)
+
+
+class BackgroundIndex(object):
+    ''' Data computed by an external worker, refreshed in the background. '''
+
+    # Minimum delay in seconds between refreshes.
+    REFRESH_INTERVAL = 30
+
+    refreshed_at = None
+    refreshing = False
+
+    def refresh(self, *args):
+        if self.refreshing or (self.refreshed_at is not None and
+                               time() - self.refreshed_at <
+                               self.REFRESH_INTERVAL):
+            return
+        self.refreshing = True
+
+        def update():
+            try:
+                self.update(*args)
+                self.refreshed_at = time()
+            except ExternalCallError as e:
+                print '{0} update failed: {1}'.format(type(self).__name__, e)
+            finally:
+                self.refreshing = False
+
+        async_worker.execute(update)
+
+
 def get_syntax_name(view_or_settings):
     if isinstance(view_or_settings, View):
         settings = view_or_settings.settings()
@@ -126,6 +250,19 @@ def get_syntax_name(view_or_settings):
         'syntax')))[0].lower()
 
 
+def replace_lines(view, edit, region, text):
+    ''' Replaces contents of region with text, touching only the lines that
+    actually change, to keep undo history, markers and folds intact. '''
+    start = region.begin()
+    for a, b, new_text in line_hunks(view.substr(region), text):
+        if a == b:
+            view.insert(edit, start + a, new_text)
+        elif not new_text:
+            view.erase(edit, Region(start + a, start + b))
+        else:
+            view.replace(edit, Region(start + a, start + b), new_text)
+
+
 def SyntaxSpecificCommand(*syntax_names):
     def is_enabled(self, **kwargs):
         return get_syntax_name(self.view) in syntax_names
@@ -2,64 +2,230 @@ import os.path
 import sys
 import re
 
-from collections import namedtuple
+from collections import deque, namedtuple
+from threading import Thread
+from time import time
 
 from sublime import ENCODED_POSITION, View, error_message, load_settings, \
     status_message
-from sublime_plugin import TextCommand
+from sublime_plugin import TextCommand, WindowCommand
+
+from powerlime.util import ExternalPythonCaller, PanelSearch, \
+    get_syntax_name
 
 
 SymbolRef = namedtuple('SymbolRef', 'file row col pos context')
 
+# Names looked up must start and end with a word character, as whole-word
+# searches would otherwise match at every word boundary.
+SYMBOL_NAME_RE = re.compile(r'\w(?:[^\n]*\w)?$', re.U)
+
+
+class HandlerQuery(Thread):
+    ''' Runs a single handler lookup in the background. '''
+
+    def __init__(self, handler, query, timeout):
+        Thread.__init__(self)
+        self.daemon = True
+        self.handler = handler
+        self.query = query
+        self.deadline = time() + timeout
+        self.tags = []
+        self.taken = 0
+        self.late = 0
+        self.error = None
+        self.latency = None
+
+    def run(self):
+        start = time()
+        try:
+            # Append one by one, so that streamed results can be taken before
+            # the lookup finishes.
+            for tag in self.handler.find_symbols(*self.query):
+                self.tags.append(tag)
+        except Exception as e:
+            self.error = e
+        self.latency = time() - start
+
+    def take(self):
+        ''' Returns results found since the previous call. '''
+        end = len(self.tags)
+        tags = self.tags[self.taken:end]
+        self.taken = end
+        return tags
+
+
+class XTagsSearch(PanelSearch):
+    ''' Collects results of concurrently running handler queries.
+
+    Results available within handler time budgets are shown at once. Late ones
+    are merged into the quick panel if it's still open, or reported in the
+    status bar otherwise.
+    '''
+
+    # Minimum delay in seconds between re-showing the panel with new results.
+    REFRESH_INTERVAL = 0.5
+
+    def __init__(self, command, names, queries):
+        PanelSearch.__init__(self, command.view.window())
+        self.command = command
+        self.names = names
+        self.pending = list(queries)
+        self.tags = []
+        self.new_tags = []
+        self.shown = False
+        self.shown_at = None
+
+    def start(self):
+        for query in self.pending:
+            query.start()
+        self.poll()
+
+    def poll_results(self):
+        finished = False
+        for query in self.pending[:]:
+            done = not query.is_alive()
+            tags = query.take()
+            self.new_tags.extend(tags)
+            if self.shown:
+                query.late += len(tags)
+            if done:
+                finished = True
+                self.pending.remove(query)
+                self.collect(query)
+                if query.late and not self.panel_open:
+                    status_message('XTags: {0} more result(s) from {1}'.format(
+                        query.late, query.handler.NAME))
+
+        now = time()
+        if not self.shown:
+            self.tags.extend(self.new_tags)
+            self.new_tags = []
+            if all(now >= query.deadline for query in self.pending):
+                if self.tags:
+                    self.show()
+                elif not self.pending:
+                    status_message('Not found: ' + ', '.join(self.names))
+        elif self.new_tags and self.panel_open and (
+                finished or now - self.shown_at >= self.REFRESH_INTERVAL):
+            self.tags.extend(self.new_tags)
+            self.new_tags = []
+            self.show()
+
+        return bool(self.pending or (self.new_tags and self.panel_open))
+
+    def collect(self, query):
+        XTagsCommand.record_latency(query.handler.NAME, query.latency)
+        if query.error is not None:
+            print 'XTags: {0} failed: {1}'.format(query.handler.NAME,
+                                                  query.error)
+
+    def show(self):
+        self.shown = True
+        self.shown_at = time()
+
+        # Group the results by symbol, in the order of selections.
+        self.tags.sort(key=lambda (name, tag): self.names.index(name))
+        if len(self.tags) == 1 and not self.pending:
+            self.command.open_tag(self.tags[0][1])
+            return
+
+        tags = self.tags[:]
+
+        def on_select(i):
+            if i != -1:
+                self.command.open_tag(tags[i][1])
+
+        multiple_names = len(self.names) > 1
+        items = [self.command.tag_to_item(tag,
+                                          name if multiple_names else None)
+                 for name, tag in tags]
+        self.show_panel(items, on_select)
+
 
 class XTagsCommand(TextCommand):
     handlers = {}
 
+    # Durations of recent queries in seconds, per handler NAME.
+    latencies = {}
+    LATENCY_HISTORY = 20
+
     def run(self, edit, language=None, source=None,
             types=('def', 'read', 'write')):
         view = self.view
         if language is None:
             language = get_syntax_name(view)
-        tags = []
-        selections = view.sel()
-        for handler in self.handler.get(language, []):
+        timeouts = view.settings().get('xtags_handler_timeouts', {})
+
+        # Fall back to language-independent handlers when no index covers the
+        # language.
+        handlers = self.handlers.get(language) or self.handlers.get('*', [])
+
+        names = []
+        queries = []
+        for handler in handlers:
             if source is None or handler.NAME == source:
-                for sel in selections:
-                    if sel.empty():
-                        name = handler.get_symbol_name(language, view, sel.a)
-                    else:
-                        name = view.substr(sel)
-                tags.extend(handler.find_symbol(language, name, types))
-
-        if not tags:
-            status_message('Not found: ' + name)
+                handler_names = self.get_symbol_names(handler, language)
+                if not handler_names:
+                    continue
+                context = handler.prepare(view)
+                for name in handler_names:
+                    if name not in names:
+                        names.append(name)
+                queries.append(HandlerQuery(
+                    handler, (language, handler_names, types, context),
+                    timeouts.get(handler.NAME, handler.TIMEOUT)))
+
+        if not queries:
+            status_message('No symbol to look up')
             return
 
-        if len(tags) > 1:
-            view.window().show_quick_panel(map(self.tag_to_item, tags),
-                    lambda i: (self.open_tag(tags[i]) if i != -1 else None))
-        else:
-            self.open_tag(tags[0])
+        XTagsSearch(self, names, queries).start()
+
+    @classmethod
+    def record_latency(cls, name, latency):
+        history = cls.latencies.get(name)
+        if history is None:
+            history = cls.latencies[name] = deque(maxlen=cls.LATENCY_HISTORY)
+        history.append(latency)
 
-    def tag_to_item(self, tag):
+    def get_symbol_names(self, handler, language):
+        ''' Returns unique symbol names under all the selections, leaving out
+        blank ones and ones not starting and ending with a word. '''
+        view = self.view
+        names = []
+        for sel in view.sel():
+            if sel.empty():
+                name = handler.get_symbol_name(language, view, sel.a)
+            else:
+                name = view.substr(sel)
+            name = (name or u'').strip()
+            if SYMBOL_NAME_RE.match(name) and name not in names:
+                names.append(name)
+        return names
+
+    def tag_to_item(self, tag, name=None):
         item = []
+        if name is not None:
+            item.append(name)
         if tag.context is not None:
             item.append(tag.context)
         if tag.row is not None:
             if tag.col is None:
                 suffix = ':{0}'.format(tag.row)
             else:
-                suffix = ':{0}:{0}'.format(tag.row, tag.col)
+                suffix = ':{0}:{1}'.format(tag.row, tag.col)
         else:
             suffix = '@{0}'.format(tag.pos)
         item.append(tag.file + suffix)
         return item
 
     def open_tag(self, tag):
-        self.view.window().open_file(
-            '{0}:{1}'.format(os.path.join(self.google3_path, tag.file),
-                tag.row + 1),
-            ENCODED_POSITION)
+        path = tag.file
+        if not os.path.isabs(path):
+            path = os.path.join(self.google3_path, path)
+        self.view.window().open_file('{0}:{1}'.format(path, tag.row + 1),
+                                     ENCODED_POSITION)
 
     @staticmethod
     def format_handler_name(name):
@@ -75,16 +241,52 @@ class XTagsCommand(TextCommand):
 
     @classmethod
     def handler(cls, handler_cls):
-        if 'NAME' not in cls.__dict__:
-            cls.NAME = cls.format_handler_name(cls.__name__)
+        if 'NAME' not in handler_cls.__dict__:
+            handler_cls.NAME = cls.format_handler_name(handler_cls.__name__)
         cls.register_handler(handler_cls())
-        return handler
+        return handler_cls
+
+
+class ShowXtagsLatenciesCommand(WindowCommand):
+    ''' Reports median and maximum durations of recent queries per handler. '''
+
+    def run(self):
+        if not XTagsCommand.latencies:
+            status_message('XTags: no queries yet')
+            return
+        lines = []
+        for name, history in sorted(XTagsCommand.latencies.iteritems()):
+            latencies = sorted(history)
+            median = latencies[len(latencies) // 2]
+            lines.append('{0}: median {1:.0f} ms, max {2:.0f} ms, {3} '
+                         'queries'.format(name, median * 1000,
+                                          latencies[-1] * 1000,
+                                          len(latencies)))
+        print 'XTags latencies:\n  ' + '\n  '.join(lines)
+        status_message('XTags: ' + '; '.join(lines))
 
 
 class TagsHandler(object):
+    # Time budget in seconds, after which results are shown without waiting
+    # for this handler. Can be overridden by xtags_handler_timeouts setting.
+    TIMEOUT = 0.5
+
+    def prepare(self, view):
+        ''' Called on the UI thread before each lookup, returns the context
+        passed to find_symbols. Handlers are shared by concurrent lookups, so
+        per-lookup state goes there rather than into attributes. '''
+        return None
+
     def get_symbol_name(self, language, view, pos):
         return view.substr(view.word(pos))
 
+    def find_symbols(self, language, names, types, context=None):
+        ''' Yields (name, SymbolRef) pairs for all the names. Handlers able to
+        look up many symbols in a single query should override this. '''
+        for name in names:
+            for tag in self.find_symbol(language, name, types):
+                yield name, tag
+
     def update_index(self, path):
         pass
 
@@ -102,3 +304,33 @@ class GoogleTagsHandler(TagsHandler):
                     flag):
                 yield SymbolRef(file=tag.filename_, row=tag.lineno_,
                     col=None, pos=tag.offset_, context=tag.snippet_)
+
+
+@XTagsCommand.handler
+class ProjectGrepHandler(TagsHandler):
+    ''' Whole-word search across project folders, used for languages not
+    covered by any index. '''
+
+    LANGUAGES = ('*', )
+    TIMEOUT = 2
+
+    # A single worker, as each search already spreads over all the cores
+    # through its process pool. Overlapping searches take turns.
+    grep = ExternalPythonCaller('grep', persistent=True)
+
+    def prepare(self, view):
+        window = view.window()
+        settings = view.settings()
+        return (window.folders() if window is not None else [],
+                settings.get('folder_exclude_patterns', []),
+                settings.get('file_exclude_patterns', []) +
+                settings.get('binary_file_patterns', []))
+
+    def find_symbols(self, language, names, types, context=None):
+        folders, folder_excludes, file_excludes = context
+        if not folders:
+            return
+        for name, path, row, col, pos, line in self.grep.search.iter(
+                folders, names, folder_excludes, file_excludes):
+            yield name, SymbolRef(file=path, row=row, col=col, pos=pos,
+                                  context=line)